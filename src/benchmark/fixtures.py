@@ -0,0 +1,128 @@
+import cv2
+import numpy as np
+from src.data.card import ReferenceCard
+
+# Frame sizes (width, height) of the synthetic frames
+RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160)
+}
+BACKGROUNDS = ["noise", "texture"]
+
+
+def render_card(rng: np.random.Generator, ref_card: ReferenceCard):
+    """Render a card-like BGR image of the size of 'ref_card': a white card
+    with value and suit-like symbols in the 2 corners and a central
+    pattern, so that 'ReferenceCard.hulls' finds the corner symbols
+    """
+    img = np.full((ref_card.height, ref_card.width, 3), 240, np.uint8)
+    x0 = ref_card.box_x_border
+    y0 = ref_card.box_y_border
+    color = (0, 0, 180) if rng.random() < 0.5 else (20, 20, 20)
+    # Value, then suit below it
+    cv2.putText(
+        img,
+        "AKQJ"[rng.integers(4)],
+        (x0 + 4, y0 + 36),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        1.1,
+        color,
+        3
+    )
+    cv2.circle(img, (x0 + 18, y0 + 58), 10, color, -1)
+    # Central pattern
+    center = (ref_card.width // 2, ref_card.height // 2)
+    cv2.circle(img, center, ref_card.width // 5, color, -1)
+    # The bottom right corner is the top left one rotated by 180 degrees
+    img = np.minimum(img, cv2.rotate(img, cv2.ROTATE_180))
+    noise = rng.integers(0, 12, img.shape, dtype=np.uint8)
+    return cv2.subtract(img, noise)
+
+
+def noise_background(rng: np.random.Generator, size: tuple):
+    """Noise BGR background of 'size' (width, height), slightly blurred
+    like the sensor noise of a camera
+    """
+    width, height = size
+    img = rng.integers(0, 100, (height, width, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(img, (5, 5), 0)
+
+
+def texture_background(rng: np.random.Generator, size: tuple):
+    """Textured BGR background of 'size' (width, height): smooth blobs and
+    stripes with a fine grain, mimicking the DTD textures
+    """
+    width, height = size
+    # Low frequency blobs, generated small and upscaled
+    blobs = rng.integers(0, 140, (height // 32 + 1, width // 32 + 1, 3),
+                         dtype=np.uint8)
+    img = cv2.resize(blobs, size, interpolation=cv2.INTER_CUBIC)
+    x = np.arange(width, dtype=np.float32)
+    period = rng.uniform(16, 64)
+    stripes = (12 * np.sin(2 * np.pi * x / period)).astype(np.int16)
+    img = img.astype(np.int16) + stripes[None, :, None]
+    img += rng.integers(-10, 10, img.shape, dtype=np.int16)
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    return cv2.GaussianBlur(img, (3, 3), 0)
+
+
+def render_frame(
+    rng: np.random.Generator,
+    size: tuple,
+    background: str = "noise",
+    card: np.array = None,
+    ref_card: ReferenceCard = ReferenceCard()
+):
+    """Render a BGR frame of 'size' (width, height) showing one card, at a
+    random position and rotation, over a synthetic background
+
+    Args:
+        rng (np.random.Generator): random generator
+        size (tuple): (width, height) of the frame
+        background (str, optional): "noise" or "texture".
+            Defaults to "noise".
+        card (np.array, optional): BGR card to paste, rendered with
+            'render_card' if not specified. Defaults to None.
+        ref_card (ReferenceCard, optional): reference card geometry.
+            Defaults to ReferenceCard().
+
+    Returns:
+        np.array: BGR frame
+    """
+    if background == "noise":
+        frame = noise_background(rng, size)
+    elif background == "texture":
+        frame = texture_background(rng, size)
+    else:
+        raise ValueError(f"Unknown background {background}")
+    if card is None:
+        card = render_card(rng, ref_card)
+
+    width, height = size
+    # The card covers about half of the frame height, fully inside it
+    scale = 0.5 * height / card.shape[0]
+    angle = rng.uniform(-30, 30)
+    radius = 0.5 * scale * np.hypot(*card.shape[:2])
+    cx = rng.uniform(radius, width - radius)
+    cy = rng.uniform(radius, height - radius)
+    M = cv2.getRotationMatrix2D(
+        (card.shape[1] / 2, card.shape[0] / 2), angle, scale)
+    M[:, 2] += (cx - card.shape[1] / 2, cy - card.shape[0] / 2)
+    warped = cv2.warpAffine(card, M, size)
+    mask = cv2.warpAffine(
+        np.full(card.shape[:2], 255, np.uint8), M, size) > 127
+    frame[mask] = warped[mask]
+    return frame
+
+
+def write_video(path: str, frames: list, fps: float = 25):
+    """Write the BGR 'frames' into the MPEG-4 video 'path'"""
+    height, width = frames[0].shape[:2]
+    video = cv2.VideoWriter(
+        path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    try:
+        for frame in frames:
+            video.write(frame)
+    finally:
+        video.release()
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+import click
+import cv2
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+import numpy as np
+from fnmatch import fnmatch
+from functools import lru_cache
+from src.benchmark.fixtures import (
+    BACKGROUNDS,
+    RESOLUTIONS,
+    render_card,
+    render_frame,
+    write_video
+)
+from src.data.card import ReferenceCard
+from src.data.extract_card import extract_card, extract_cards_from_video
+
+
+def measure(func, inputs: list, repeat: int = 3, items_per_call: int = 1):
+    """Time 'func' on every input of 'inputs', 'repeat' times, after a
+    warm-up call. The peak memory is measured afterwards, during one more
+    pass under tracemalloc, so that tracing does not slow the timed calls.
+
+    Args:
+        func (callable): function called as func(input), returning a value
+            which is considered successful if true
+        inputs (list): inputs of 'func'
+        repeat (int, optional): number of passes over 'inputs'.
+            Defaults to 3.
+        items_per_call (int, optional): number of items (e.g. frames)
+            processed by a call, for the throughput. Defaults to 1.
+
+    Returns:
+        dict: throughput (items/s), latency percentiles of a call (ms),
+            peak memory allocated during a call (MB) and ratio of
+            successful calls
+    """
+    func(inputs[0])
+    latencies = []
+    successes = 0
+    for _ in range(repeat):
+        for x in inputs:
+            start = time.perf_counter()
+            successes += bool(func(x))
+            latencies.append(time.perf_counter() - start)
+
+    peak = 0
+    tracemalloc.start()
+    try:
+        for x in inputs:
+            tracemalloc.reset_peak()
+            func(x)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "calls": len(latencies),
+        "throughput": items_per_call * len(latencies) / latencies.sum() *
+        1000,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p90_ms": float(np.percentile(latencies, 90)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "peak_mem_mb": peak / 2**20,
+        "success_ratio": successes / len(latencies)
+    }
+
+
+def _fixture_rng(seed: int, key: str):
+    """Random generator of the fixtures 'key': the fixtures of a benchmark
+    do not depend on the benchmarks which are run before it
+    """
+    return np.random.default_rng([seed, zlib.crc32(key.encode())])
+
+
+def _extract_card_benchmarks(seed: int, nb_frames: int):
+    """extract_card on single frames, for every resolution and background"""
+    for res, size in RESOLUTIONS.items():
+        for background in BACKGROUNDS:
+            name = f"extract_card[{res}-{background}]"
+
+            def frames(name=name, size=size, background=background):
+                rng = _fixture_rng(seed, name)
+                return [
+                    render_frame(rng, size, background)
+                    for _ in range(nb_frames)
+                ]
+
+            yield (
+                name,
+                lambda img: extract_card(img, min_focus=0)[0],
+                frames,
+                1
+            )
+
+
+def _video_benchmarks(seed: int, nb_frames: int, tmp_dir: str):
+    """extract_cards_from_video on a synthesized 720p video"""
+    name = "extract_cards_from_video[720p]"
+
+    def video():
+        rng = _fixture_rng(seed, name)
+        card = render_card(rng, ReferenceCard())
+        video_file = os.path.join(tmp_dir, "benchmark.mp4")
+        write_video(video_file, [
+            render_frame(rng, RESOLUTIONS["720p"], "texture", card)
+            for _ in range(nb_frames)
+        ])
+        return [video_file]
+
+    yield (
+        name,
+        lambda path: len(extract_cards_from_video(
+            path, None, keep_ratio=1, min_focus=0)),
+        video,
+        nb_frames
+    )
+
+
+def _hull_benchmarks(seed: int, nb_cards: int):
+    """Corner hulls of rendered cards"""
+    ref_card = ReferenceCard()
+
+    # Rendered once for both benchmarks
+    @lru_cache(maxsize=None)
+    def cards():
+        rng = _fixture_rng(seed, "ReferenceCard.hull")
+        return [render_card(rng, ref_card) for _ in range(nb_cards)]
+
+    yield (
+        "ReferenceCard.hull",
+        lambda img: ref_card.hull(img) is not None,
+        cards,
+        1
+    )
+    yield (
+        "ReferenceCard.hulls",
+        lambda img: all(h is not None for h in ref_card.hulls(img)),
+        cards,
+        1
+    )
+
+
+def run_benchmarks(
+    name_filter: str = "*",
+    repeat: int = 3,
+    nb_frames: int = 8,
+    seed: int = 0
+):
+    """Run the benchmarks whose name matches 'name_filter', on synthetic
+    fixtures generated with the seed 'seed'
+
+    Returns:
+        dict: environment and results of every benchmark, by name
+    """
+    logger = logging.getLogger(__name__)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        benchmarks = [
+            _extract_card_benchmarks(seed, nb_frames),
+            _video_benchmarks(seed, 8 * nb_frames, tmp_dir),
+            _hull_benchmarks(seed, 16 * nb_frames)
+        ]
+        for group in benchmarks:
+            # The inputs are only rendered for the benchmarks which are run
+            for name, func, inputs, items_per_call in group:
+                if not fnmatch(name, name_filter):
+                    continue
+                results[name] = measure(
+                    func, inputs(), repeat, items_per_call)
+                logger.info(
+                    f"{name:<36} {results[name]['throughput']:10.1f}/s  "
+                    f"p50 {results[name]['p50_ms']:9.2f}ms  "
+                    f"p99 {results[name]['p99_ms']:9.2f}ms  "
+                    f"peak {results[name]['peak_mem_mb']:7.1f}MB")
+    return {
+        "environment": {
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": seed,
+            "repeat": repeat,
+            "nb_frames": nb_frames
+        },
+        "results": results
+    }
+
+
+def compare(report: dict, baseline: dict, max_regression: float = 0.2):
+    """Compare the p50 latencies of 'report' with the ones of 'baseline'
+
+    Returns:
+        list: names of the benchmarks slower than in 'baseline' by more
+            than 'max_regression' (relative)
+    """
+    logger = logging.getLogger(__name__)
+    regressions = []
+    for name, result in report["results"].items():
+        if name not in baseline["results"]:
+            continue
+        ratio = result["p50_ms"] / baseline["results"][name]["p50_ms"]
+        regressed = ratio > 1 + max_regression
+        logger.log(
+            logging.WARNING if regressed else logging.INFO,
+            f"{name:<36} p50 x{ratio:.2f} vs baseline"
+            + (" REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+@click.command()
+@click.argument(
+    'output_file',
+    type=click.Path(),
+    default="reports/benchmark.json"
+)
+@click.option(
+    '--baseline',
+    default=None,
+    type=click.Path(exists=True),
+    help='JSON report of a previous run to compare with. The command fails '
+    'if a benchmark is slower than in the baseline.'
+)
+@click.option(
+    '--max-regression',
+    default=0.2,
+    type=click.FloatRange(min=0),
+    help='Tolerated relative increase of the p50 latency.'
+)
+@click.option(
+    '--filter',
+    'name_filter',
+    default="*",
+    help='Only run the benchmarks matching this shell pattern, '
+    'e.g. "extract_card*".'
+)
+@click.option(
+    '--repeat',
+    default=3,
+    type=click.IntRange(min=1),
+    help='Number of passes over the inputs of every benchmark.'
+)
+@click.option(
+    '--nb-frames',
+    default=8,
+    type=click.IntRange(min=1),
+    help='Number of synthetic frames per benchmark of extract_card.'
+)
+def run_benchmark(
+    output_file: str,
+    baseline: str = None,
+    max_regression: float = 0.2,
+    name_filter: str = "*",
+    repeat: int = 3,
+    nb_frames: int = 8
+):
+    """ Benchmark the card extraction and the hull labeling on synthetic
+        frames, and save the results in a JSON report.
+    """
+    logger = logging.getLogger(__name__)
+    report = run_benchmarks(name_filter, repeat, nb_frames)
+    if os.path.dirname(output_file):
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(output_file, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results saved in {output_file}")
+
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare(report, json.load(f), max_regression)
+        if regressions:
+            raise click.ClickException(
+                f"Performance regression of {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    run_benchmark()
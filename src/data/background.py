@@ -1,50 +1,277 @@
 from subprocess import call
 from glob import glob
-import matplotlib.image as mpimg
-from matplotlib.pyplot import plt
+from functools import partial
+from multiprocessing import Pool
+import matplotlib.pyplot as plt
+import numpy as np
+import cv2
+import csv
 import pickle
 import random
 import os
-from pathlib import Path
 import logging
 
 log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 logging.basicConfig(level=logging.INFO, format=log_fmt)
 logger = logging.getLogger(__name__)
 
+BLOB_FILE = "backgrounds.bin"
+INDEX_FILE = "index.csv"
+INDEX_FIELDS = ["offset", "height", "width", "channels", "source"]
+# Pickled list of backgrounds saved by the previous versions
+LEGACY_PICKLE = "backgrounds.pck"
+
+
+def _recover(blob_path: str, index_path: str):
+    """Bring the blob and the index of a store back to a consistent state,
+    after an interrupted write: index rows which can not be parsed or which
+    reference missing pixels are dropped, and the blob is truncated after
+    the last indexed image.
+
+    Returns:
+        list: valid index rows, without header
+    """
+    rows = []
+    if os.path.exists(index_path):
+        with open(index_path, newline="") as f:
+            rows = list(csv.reader(f))[1:]
+    blob_size = os.path.getsize(blob_path) \
+        if os.path.exists(blob_path) else 0
+
+    valid_rows = []
+    end = 0
+    for row in rows:
+        try:
+            offset, height, width, channels = (int(v) for v in row[:4])
+        except ValueError:
+            break
+        if len(row) != len(INDEX_FIELDS) or offset != end \
+                or offset + height * width * channels > blob_size:
+            break
+        valid_rows.append(row)
+        end = offset + height * width * channels
+
+    if len(valid_rows) != len(rows) or not os.path.exists(index_path):
+        with open(index_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(INDEX_FIELDS)
+            writer.writerows(valid_rows)
+    if blob_size != end:
+        with open(blob_path, "ab") as f:
+            f.truncate(end)
+    return valid_rows
+
+
+def load_background(path: str, target_size: tuple = None):
+    """Decode the image 'path' into a RGB uint8 array, optionally resized
+    to 'target_size' (width, height)
+
+    Returns:
+        tuple: 'path' and the image (None if it could not be decoded)
+    """
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return path, None
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    if target_size is not None:
+        img = cv2.resize(img, target_size, interpolation=cv2.INTER_AREA)
+    return path, img
+
+
+class BackgroundStoreWriter():
+    """Append images to a background store, see 'BackgroundStore'
+
+    The pixels of an image are appended to the blob before its entry is
+    appended to the index, so the index only references complete images.
+    When an existing store is opened, entries left incomplete by an
+    interrupted writer are discarded, so that appending can resume.
+    """
+
+    def __init__(self, store_dir: str):
+        os.makedirs(store_dir, exist_ok=True)
+        blob_path = os.path.join(store_dir, BLOB_FILE)
+        index_path = os.path.join(store_dir, INDEX_FILE)
+        rows = _recover(blob_path, index_path)
+        self.sources = set(r[-1] for r in rows)
+        self._blob = open(blob_path, "ab")
+        self._index = open(index_path, "a", newline="")
+        self._csv = csv.writer(self._index)
+        self._offset = self._blob.tell()
+
+    def append(self, img: np.array, source: str = ""):
+        """Append the image 'img' (uint8, shape (h, w) or (h, w, c))"""
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        height, width = img.shape[:2]
+        channels = img.shape[2] if img.ndim == 3 else 1
+        self._blob.write(img.tobytes())
+        self._blob.flush()
+        self._csv.writerow([self._offset, height, width, channels, source])
+        self._index.flush()
+        self._offset += img.nbytes
+        self.sources.add(source)
+
+    def close(self):
+        self._blob.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BackgroundStore():
+    """Background images packed in a single uint8 blob, memory-mapped, with
+    an index giving the offset and shape of every image in the blob
+
+    Images are returned as read-only views on the memory map: nothing is
+    loaded at startup, and processes using the same store share its pages
+    through the OS cache.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, INDEX_FILE), newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.offsets = np.array([int(r["offset"]) for r in rows], np.int64)
+        self.shapes = [
+            (int(r["height"]), int(r["width"]), int(r["channels"]))
+            for r in rows
+        ]
+        self.sources = [r["source"] for r in rows]
+        blob_path = os.path.join(store_dir, BLOB_FILE)
+        self._blob = (
+            np.memmap(blob_path, dtype=np.uint8, mode="r")
+            if rows else np.zeros(0, dtype=np.uint8)
+        )
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __getitem__(self, i: int):
+        height, width, channels = self.shapes[i]
+        size = height * width * channels
+        img = self._blob[self.offsets[i]:self.offsets[i] + size]
+        if channels == 1:
+            return img.reshape(height, width)
+        return img.reshape(height, width, channels)
+
+    @staticmethod
+    def pack(images, store_dir: str):
+        """Create (or extend) the store 'store_dir' with 'images'"""
+        with BackgroundStoreWriter(store_dir) as writer:
+            for img in images:
+                writer.append(img)
+
+    @staticmethod
+    def from_pickle(background_pck: str, store_dir: str):
+        """Convert a legacy pickled list of backgrounds to a store"""
+        with open(background_pck, 'rb') as f:
+            BackgroundStore.pack(pickle.load(f), store_dir)
+
 
 class Backgrounds():
-    def __init__(self, background_pck="data/raw/backgrounds/backgrounds.pck"):
-        self.background_pck = background_pck
-        self._images = pickle.load(open(background_pck, 'rb'))
+    def __init__(self, background_dir="data/raw/backgrounds"):
+        self.background_dir = background_dir
+        self._images = None
+        self._nb_images = 0
+        legacy_pck = os.path.join(background_dir, LEGACY_PICKLE)
+        if not os.path.exists(os.path.join(background_dir, INDEX_FILE)) \
+                and os.path.exists(legacy_pck):
+            logger.info(f"Converting {legacy_pck} to a background store")
+            BackgroundStore.from_pickle(legacy_pck, background_dir)
+        if os.path.exists(os.path.join(background_dir, INDEX_FILE)):
+            self._load()
+
+    def _load(self):
+        self._images = BackgroundStore(self.background_dir)
         self._nb_images = len(self._images)
-        logger.info("Nb of images loaded :", self._nb_images)
+        logger.info(f"Nb of images loaded : {self._nb_images}")
 
     def get_random(self, display=False):
+        """Return a random background, as a read-only view"""
+        if self._nb_images == 0:
+            raise ValueError(
+                f"No background in {self.background_dir}, "
+                "see 'Backgrounds.download'")
         bg = self._images[random.randint(0, self._nb_images-1)]
         if display:
             plt.imshow(bg)
         return bg
 
-    def download(self):
-        call(["wget", "https://www.robots.ox.ac.uk/~vgg/data/dtd/download/dtd-r1.0.1.tar.gz"])
-        call(["tar", "xf", "dtd-r1.0.1.tar.gz"])
+    def ingest(
+        self,
+        files: list,
+        workers: int = None,
+        target_size: tuple = None
+    ):
+        """Decode the images 'files' with a pool of 'workers' processes and
+        append them to the store as soon as they are decoded. Images already
+        in the store are skipped, so that an interrupted ingestion can be
+        resumed by calling 'ingest' again.
+
+        Args:
+            files (list): paths of the images
+            workers (int, optional): number of decoding processes.
+                Defaults to None (number of CPUs).
+            target_size (tuple, optional): if specified, images are resized
+                to (width, height) during ingestion. Defaults to None.
+        """
+        with BackgroundStoreWriter(self.background_dir) as writer:
+            todo = [f for f in files if f not in writer.sources]
+            logger.info(
+                f"Ingesting {len(todo)} images "
+                f"({len(files) - len(todo)} already in store)")
+            with Pool(workers) as pool:
+                for f, img in pool.imap_unordered(
+                        partial(load_background, target_size=target_size),
+                        todo,
+                        chunksize=16):
+                    if img is None:
+                        logger.warning(f"Could not decode {f}")
+                        continue
+                    writer.append(img, source=f)
+
+        self._load()
+
+    def download(
+        self,
+        workers: int = None,
+        target_size: tuple = None,
+        resume: bool = True
+    ):
+        """Download the DTD textures and ingest them in the store
 
+        Args:
+            workers (int, optional): number of decoding processes.
+                Defaults to None (number of CPUs).
+            target_size (tuple, optional): if specified, images are resized
+                to (width, height) during ingestion. Defaults to None.
+            resume (bool, optional): if True, the archive already downloaded
+                and the images already in the store are reused, otherwise
+                the store is rebuilt from scratch. Defaults to True.
+        """
+        archive = "dtd-r1.0.1.tar.gz"
         dtd_dir = "dtd/images/"
-        bg_images = []
-        for subdir in glob(dtd_dir+"/*"):
-            for f in glob(subdir+"/*.jpg"):
-                bg_images.append(mpimg.imread(f))
 
-        logger.info("Nb of images loaded :", len(bg_images))
-        logger.info("Saved in :", self.background_pck)
+        if not resume:
+            # Start from an empty store
+            for fn in (BLOB_FILE, INDEX_FILE):
+                path = os.path.join(self.background_dir, fn)
+                if os.path.exists(path):
+                    os.remove(path)
 
-        if not Path(os.path.dirname(self.background_pck)).exists():
-            os.mkdirs(os.path.dirname(self.background_pck), exist_ok=True)
+        if not (resume and os.path.isdir(dtd_dir)):
+            call(["wget", "-c", "https://www.robots.ox.ac.uk/~vgg/data/dtd/"
+                  "download/" + archive])
+            call(["tar", "xf", archive])
 
-        pickle.dump(bg_images, open(self.backgrounds_pck_fn, 'wb'))
+        files = sorted(glob(dtd_dir + "/*/*.jpg"))
+        self.ingest(files, workers=workers, target_size=target_size)
+        logger.info(f"Saved in : {self.background_dir}")
 
-        call(["rm", "dtd-r1.0.1.tar.gz"])
+        call(["rm", archive])
         call(["rm", "-r", "dtd"])
 
 
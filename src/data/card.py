@@ -1,8 +1,96 @@
-from abc import ABC
+from functools import lru_cache
 import numpy as np
 import cv2
 
 
+_KERNEL = np.ones((3, 3), np.uint8)
+
+
+def _read_only(arr: np.array):
+    """Flag 'arr' as read-only so that it can be safely shared"""
+    arr.flags.writeable = False
+    return arr
+
+
+@lru_cache(maxsize=None)
+def _alphamask(width: int, height: int, bord_size: int):
+    """Build the mask making transparent the border and the rounded corners
+    of a card of dimensions (width, height). Cached per card size, the
+    returned mask is read-only.
+    """
+    alphamask = np.full((height, width), 255, dtype=np.uint8)
+    cv2.rectangle(
+        alphamask,
+        (0, 0),
+        (width-1, height-1),
+        0,
+        bord_size
+    )
+    cv2.line(
+        alphamask,
+        (bord_size*3, 0),
+        (0, bord_size*3),
+        0,
+        bord_size
+    )
+    cv2.line(
+        alphamask,
+        (width - bord_size*3, 0),
+        (width, bord_size*3),
+        0,
+        bord_size
+    )
+    cv2.line(
+        alphamask,
+        (0, height-bord_size*3),
+        (bord_size*3, height),
+        0,
+        bord_size
+    )
+    cv2.line(
+        alphamask,
+        (width-bord_size*3, height),
+        (width, height-bord_size*3),
+        0,
+        bord_size
+    )
+    return _read_only(alphamask)
+
+
+def _contours_area_centroid(contours: list):
+    """Compute the area and the center of gravity of all the 'contours' at
+    once, with the shoelace formula. The values are the same as the ones
+    given by cv2.contourArea and cv2.moments, NaN centroids for empty
+    contours.
+
+    Returns:
+        tuple: arrays of areas, x and y of the centers of gravity
+    """
+    lengths = np.array([len(c) for c in contours])
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    pts = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+    # Index of the next point of every point, in its own contour
+    nxt = np.arange(1, len(pts) + 1)
+    nxt[ends - 1] = starts
+    x0, y0 = pts.T
+    x1, y1 = pts[nxt].T
+    cross = x0 * y1 - x1 * y0
+    a2 = np.add.reduceat(cross, starts)
+    # NaN instead of a division by zero for the empty contours
+    a6 = np.where(a2 == 0, np.nan, 3 * a2)
+    cx = np.add.reduceat((x0 + x1) * cross, starts) / a6
+    cy = np.add.reduceat((y0 + y1) * cross, starts) / a6
+    return np.abs(a2) / 2, cx, cy
+
+
+def _zone(box: np.array):
+    """Rectangular zone (x1, y1, x2, y2) delimited by the 4 points 'box'"""
+    x1, y1 = box.min(axis=0).astype(int)
+    x2, y2 = box.max(axis=0).astype(int)
+    return x1, y1, x2, y2
+
+
 class ReferenceCard():
 
     def __init__(
@@ -22,7 +110,48 @@ class ReferenceCard():
         self.box_y_border = int(box_y_border * zoom)
         self.box_y_height = int(box_y_height * zoom)
 
+        # The geometry is immutable, so it is computed once and the same
+        # read-only arrays are handed out on every call
+        self._box_tl = _read_only(self._build_box_tl())
+        self._box_br = _read_only(self._build_box_br())
+        self._card = _read_only(self._build_card())
+        self._card_rotated = _read_only(self._build_card_rotated())
+        self._corner_zones = [_zone(self._box_tl), _zone(self._box_br)]
+
+    def params(self):
+        """Dimensions of the reference card, in pixels"""
+        return (
+            self.width,
+            self.height,
+            self.box_x_border,
+            self.box_x_width,
+            self.box_y_border,
+            self.box_y_height
+        )
+
+    def corner_zones(self):
+        """Zones (x1, y1, x2, y2) delimited by 'box_tl' and 'box_br'"""
+        return self._corner_zones
+
     def box_tl(self):
+        return self._box_tl
+
+    def box_br(self):
+        return self._box_br
+
+    def card(self):
+        return self._card
+
+    def card_rotated(self):
+        return self._card_rotated
+
+    def alphamask(self, bord_size: int = 2):
+        """Return the (read-only) alpha mask of the card, transparent on the
+        border and in the rounded corners of the card
+        """
+        return _alphamask(self.width, self.height, bord_size)
+
+    def _build_box_tl(self):
         return np.array(
             [
                 [self.box_x_border, self.box_y_border],
@@ -31,7 +160,7 @@ class ReferenceCard():
                 [self.box_x_border, self.box_y_height]
             ], dtype=np.float32)
 
-    def box_br(self):
+    def _build_box_br(self):
         return np.array(
             [
                 [self.width - self.box_x_border,
@@ -46,73 +175,91 @@ class ReferenceCard():
             dtype=np.float32)
 
     def boxes(self):
-        return np.array([self.ref_box_hl(), self.ref_box_lr()])
+        return np.array([self.box_tl(), self.box_br()])
 
     def hull(self, img: np.array, box: list = None):
         """
             Find in the zone 'box' of image 'img' and return, the convex hull
             delimiting the value and suit symbols
             'box' (shape (4,2)) is an array of 4 points delimiting a
-            rectangular zone, takes one of the 2 possible values : refboxHL or
-            refboxLR
+            rectangular zone, takes one of the 2 possible values : box_tl or
+            box_br
         """
 
         if box is None:
-            box = self.ref_box_tl()
+            box = self.box_tl()
+
+        return self.hulls(img, [box])[0]
+
+    def hulls(self, img: np.array, boxes: list = None):
+        """
+            Same as 'hull' for several zones at once, by default the 2
+            corners 'box_tl' and 'box_br'. The contours of all the zones are
+            filtered together, with vectorized computations.
+            Returns the list of hulls (None for a zone without valid hull)
+        """
+
+        if boxes is None:
+            zones = self._corner_zones
+        else:
+            zones = [_zone(box) for box in boxes]
 
-        kernel = np.ones((3, 3), np.uint8)
-        box = box.astype(np.int)
+        contours = []
+        counts = []
+        origins = []
+        sizes = []
+        for x1, y1, x2, y2 in zones:
+            # We will focus on the zone of 'img' delimited by the box
+            origins.append((x1, y1))
+            sizes.append((x2-x1, y2-y1))
+            zone = img[y1:y2, x1:x2]
 
-        # We will focus on the zone of 'img' delimited by 'box'
-        x1, y1 = box[0]
-        x2, y2 = box[2]
-        w = x2-x1
-        h = y2-y1
-        zone = img[y1:y2, x1:x2].copy()
+            gray = cv2.cvtColor(zone, cv2.COLOR_BGR2GRAY)
+            thld = cv2.Canny(gray, 30, 200)
+            thld = cv2.dilate(thld, _KERNEL, iterations=1)
 
-        gray = cv2.cvtColor(zone, cv2.COLOR_BGR2GRAY)
-        thld = cv2.Canny(gray, 30, 200)
-        thld = cv2.dilate(thld, kernel, iterations=1)
+            # Find the contours
+            zone_contours, _ = cv2.findContours(
+                thld, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            contours.extend(zone_contours)
+            counts.append(len(zone_contours))
 
-        # Find the contours
-        contours, _ = cv2.findContours(
-            thld.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        hulls = [None] * len(zones)
+        if not contours:
+            return hulls
 
         # We will reject contours with small area. TWEAK, 'zoom' dependant
         min_area = 30
         # Reject contours with a low solidity. TWEAK
         min_solidity = 0.3
 
-        # We will aggregate in 'concat_contour' the contours
-        # that we want to keep
-        concat_contour = None
+        w, h = np.repeat(np.array(sizes, dtype=np.float64), counts, axis=0).T
+        area, cx, cy = _contours_area_centroid(contours)
+        # Integer centers of gravity, as with int(m10/m00)
+        cx, cy = np.trunc(cx), np.trunc(cy)
+        #  abs(w/2-cx)<w*0.3 and abs(h/2-cy)<h*0.4 : TWEAK, the idea here
+        # is to keep only the contours which are closed to the center of
+        # the zone
+        keep = (area >= min_area) \
+            & (np.abs(w/2-cx) < w*0.3) \
+            & (np.abs(h/2-cy) < h*0.4)
+        # The convex hull, needed for the solidity, is only computed for
+        # the contours which passed the cheaper tests above
+        for i in np.flatnonzero(keep):
+            hull_area = cv2.contourArea(cv2.convexHull(contours[i]))
+            keep[i] = hull_area > 0 and area[i] / hull_area > min_solidity
 
-        for c in contours:
-            area = cv2.contourArea(c)
-
-            hull = cv2.convexHull(c)
-            hull_area = cv2.contourArea(hull)
-            solidity = float(area)/hull_area
-            # Determine the center of gravity (cx,cy) of the contour
-            M = cv2.moments(c)
-            cx = int(M['m10']/M['m00'])
-            cy = int(M['m01']/M['m00'])
-            #  abs(w/2-cx)<w*0.3 and abs(h/2-cy)<h*0.4 : TWEAK, the idea here
-            # is to keep only the contours which are closed to the center of
-            # the zone
-            if area >= min_area \
-                    and abs(w/2-cx) < w*0.3 \
-                    and abs(h/2-cy) < h*0.4 \
-                    and solidity > min_solidity:
-                if concat_contour is None:
-                    concat_contour = c
-                else:
-                    concat_contour = np.concatenate((concat_contour, c))
-
-        if concat_contour is not None:
-            # At this point, we suppose that 'concat_contour' contains only
-            # the contours corresponding the value and suit symbols
+        # The contours of the zone 'i' are contours[ends[i]-counts[i]:ends[i]]
+        ends = np.cumsum(counts)
+        for i in range(len(zones)):
+            start = ends[i] - counts[i]
+            selected = start + np.flatnonzero(keep[start:ends[i]])
+            if len(selected) == 0:
+                continue
+            # At this point, we suppose that the selected contours contain
+            # only the contours corresponding the value and suit symbols
             # We can now determine the hull
+            concat_contour = np.concatenate([contours[j] for j in selected])
             hull = cv2.convexHull(concat_contour)
             hull_area = cv2.contourArea(hull)
             # If the area of the hull is to small or too big, there may
@@ -120,17 +267,14 @@ class ReferenceCard():
             min_hull_area = 520  # TWEAK, deck and 'zoom' dependant
             max_hull_area = 2120  # TWEAK, deck and 'zoom' dependant
             if hull_area < min_hull_area or hull_area > max_hull_area:
-                return None
-            # So far, the coordinates of the hull are relative to 'zone'
-            # We need the coordinates relative to the image -> 'hull_in_img'
-            hull_in_img = hull+box[0]
-        else:
-            return None
-
-        return hull_in_img
+                continue
+            # So far, the coordinates of the hull are relative to the zone
+            # We need the coordinates relative to the image
+            hulls[i] = hull + np.array(origins[i])
 
-    def card(self):
+        return hulls
 
+    def _build_card(self):
         return np.array(
             [[0, 0],
              [self.width, 0],
@@ -139,7 +283,7 @@ class ReferenceCard():
             dtype=np.float32
         )
 
-    def card_rotated(self):
+    def _build_card_rotated(self):
         return np.array(
             [[self.width, 0],
              [self.width, self.height],
@@ -0,0 +1,104 @@
+import cv2
+import numpy as np
+from collections import deque
+
+
+def card_hash(card_img: np.array, hash_size: int = 8):
+    """Difference hash of a card: the gray card is downsampled to
+    ('hash_size' + 1) x 'hash_size' pixels and every bit tells whether a
+    pixel is brighter than its right neighbour. Near-identical cards have
+    hashes differing by a few bits only.
+
+    Args:
+        card_img (np.array): BGR or BGRA card
+        hash_size (int, optional): the hash has 'hash_size'**2 bits.
+            Defaults to 8.
+
+    Returns:
+        np.array: boolean array of 'hash_size'**2 bits
+    """
+    if card_img.ndim == 3:
+        code = cv2.COLOR_BGRA2GRAY if card_img.shape[2] == 4 \
+            else cv2.COLOR_BGR2GRAY
+        card_img = cv2.cvtColor(card_img, code)
+    small = cv2.resize(
+        card_img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return (small[:, 1:] > small[:, :-1]).ravel()
+
+
+def hamming(hash1: np.array, hash2: np.array):
+    """Number of bits differing between 2 hashes of 'card_hash'"""
+    return int(np.count_nonzero(hash1 != hash2))
+
+
+class NearDuplicateFilter():
+    """Select the sharpest card of every run of near-duplicate cards
+
+    Cards are fed in frame order. Consecutive cards whose hashes differ by
+    at most 'max_distance' bits form a run, of which only the card with the
+    best focus is kept. The kept card is then only emitted if it also
+    differs by more than 'max_distance' bits from the last 'history'
+    emitted cards, so that a card shown again after a short move is not
+    kept twice.
+
+    Contrary to keeping one frame every N frames, nothing is lost when the
+    camera moves fast, and a static camera yields a single card.
+    """
+
+    def __init__(self, max_distance: int = 6, history: int = 8):
+        """
+        Args:
+            max_distance (int, optional): maximal number of differing hash
+                bits between 2 near-duplicate cards. Defaults to 6.
+            history (int, optional): number of emitted cards a new card is
+                compared with. Defaults to 8.
+        """
+        self.max_distance = max_distance
+        self.nb_seen = 0
+        self.nb_kept = 0
+        self._keepers = deque(maxlen=history)
+        self._best = None
+        self._run_hash = None
+
+    def _novel(self, card_hash: np.array):
+        return all(
+            hamming(card_hash, h) > self.max_distance for h in self._keepers)
+
+    def _emit(self):
+        """The best card of the current run, if novel, else None"""
+        best, self._best = self._best, None
+        if best is None or not self._novel(best[0]):
+            return None
+        self._keepers.append(best[0])
+        self.nb_kept += 1
+        return best[2]
+
+    def push(self, card_hash: np.array, focus: float, item):
+        """Feed the next card
+
+        Args:
+            card_hash (np.array): hash of the card, see 'card_hash'
+            focus (float): focus of the card, the sharpest card of a run is
+                kept
+            item: what is returned when the card is selected
+
+        Returns:
+            'item' of the card selected in the run ended by this card, None
+                if the run goes on or its best card is not novel
+        """
+        self.nb_seen += 1
+        selected = None
+        # Cards are compared with the first card of the run, so that a slow
+        # drift of the camera still splits the run
+        if self._run_hash is None or \
+                hamming(card_hash, self._run_hash) > self.max_distance:
+            selected = self._emit()
+            self._run_hash = card_hash
+        if self._best is None or focus > self._best[1]:
+            self._best = (card_hash, focus, item)
+        return selected
+
+    def flush(self):
+        """'item' of the best card of the last run, None if not novel"""
+        self._run_hash = None
+        return self._emit()
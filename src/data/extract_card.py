@@ -3,8 +3,20 @@ import cv2
 import os
 from uuid import uuid4
 from src.data.card import ReferenceCard
+from src.data.dedup import NearDuplicateFilter, card_hash
+from src.data.focus import FOCUS_MODES, FocusGate, top_focus_threshold
+from src.data.metrics import Metrics
+from src.data.workspace import FrameWorkspace, thread_workspace
+from src.data.writer import CardWriter
 import shutil
 import logging
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from src.visualization.visualize import display_image
 
 
@@ -16,47 +28,28 @@ def alphamask(
     ref_card: ReferenceCard = ReferenceCard(),
     bord_size: int = 2
 ):
-    alphamask = np.ones(
-        (ref_card.height, ref_card.width),
-        dtype=np.uint8
-    ) * 255
-    cv2.rectangle(
-        alphamask,
-        (0, 0),
-        (ref_card.width-1, ref_card.height-1),
-        0,
-        bord_size
-    )
-    cv2.line(
-        alphamask,
-        (bord_size*3, 0),
-        (0, bord_size*3),
-        0,
-        bord_size
-    )
-    cv2.line(
-        alphamask,
-        (ref_card.width - bord_size*3, 0),
-        (ref_card.width, bord_size*3),
-        0,
-        bord_size
-    )
-    cv2.line(
-        alphamask,
-        (0, ref_card.height-bord_size*3),
-        (bord_size*3, ref_card.height),
-        0,
-        bord_size
-    )
-    cv2.line(
-        alphamask,
-        (ref_card.width-bord_size*3, ref_card.height),
-        (ref_card.width, ref_card.height-bord_size*3),
-        0,
-        bord_size
-    )
+    """Return the read-only alpha mask of 'ref_card', see
+    'ReferenceCard.alphamask'
+    """
+    return ref_card.alphamask(bord_size)
+
+
+@contextmanager
+def _timed(metrics: Metrics, stage: str):
+    """Add the time spent in the block to the timer 'stage' of 'metrics',
+    nothing is measured if 'metrics' is None
+    """
+    if metrics is None:
+        yield
+        return
+    with metrics.timed(stage):
+        yield
 
-    return alphamask
+
+def _count(metrics: Metrics, name: str):
+    """Increment the counter 'name' of 'metrics', if not None"""
+    if metrics is not None:
+        metrics.count(name)
 
 
 def varianceOfLaplacian(img):
@@ -66,47 +59,138 @@ def varianceOfLaplacian(img):
     Source: A.Rosebrock,
     https://www.pyimagesearch.com/2015/09/07/blur-detection-with-opencv/
     """
-    return cv2.Laplacian(img, cv2.CV_64F).var()
+    return frame_focus(img)
 
 
-def extract_card(
-        img,
-        output_path=None,
-        ref_card: ReferenceCard = ReferenceCard(),
-        min_focus=120,
-        debug=False
+def frame_focus(
+    img,
+    coarse_scale: float = None,
+    workspace: FrameWorkspace = None
 ):
+    """Focus measure of 'img' as used by 'extract_card': the variance of
+    its Laplacian, see 'FrameWorkspace.focus'. If 'coarse_scale' is
+    specified, the focus is measured on the downscaled image, which is much
+    cheaper but gives higher values than on the full resolution image.
+
+    If specified, 'workspace' must be loaded with 'img': the focus is
+    measured in its buffers, reused from one frame to the next. The focus
+    images are not shared with the next stages, which read the gray
+    pyramid of the workspace.
+    """
+    if workspace is None:
+        workspace = thread_workspace(img)
+    return workspace.focus(coarse_scale)
+
+
+def _largest_contour(edge, min_area: float = 0, offset=(0, 0)):
+    """Find the external contours of the edge image 'edge' and return the
+    one with the largest area, translated by 'offset'. Contours with an area
+    below 'min_area' are ignored, None is returned if no contour is left.
     """
+    cnts, _ = cv2.findContours(
+        edge,
+        cv2.RETR_EXTERNAL,
+        cv2.CHAIN_APPROX_SIMPLE,
+        offset=offset
+    )
+
+    # We suppose that the contour with largest area corresponds
+    # to the contour delimiting the card. A single pass is enough to
+    # find it, no need to sort the (possibly thousands of) contours
+    best_cnt = None
+    best_area = min_area
+    for cnt in cnts:
+        area = cv2.contourArea(cnt)
+        if area > best_area or (best_cnt is None and area == best_area):
+            best_cnt = cnt
+            best_area = area
+    return best_cnt
+
+
+def _coarse_roi(
+    workspace: FrameWorkspace,
+    coarse_scale: float,
+    roi_margin: float,
+    min_card_area: float
+):
+    """First stage of the cascade: locate the card on the frame of
+    'workspace' downscaled by 'coarse_scale' and return the zone
+    (x1, y1, x2, y2) of the frame around it, or None if no card candidate
+    is found
     """
-    imgwarp = None
-    # Check the image is not too blurry
-    focus = varianceOfLaplacian(img)
-    if focus < min_focus:
-        if debug:
-            print("Focus too low :", focus)
-        return False, None
+    edge = workspace.coarse_edges(coarse_scale)
+    cnt = _largest_contour(
+        edge,
+        min_area=min_card_area * edge.shape[0] * edge.shape[1]
+    )
+    if cnt is None:
+        return None
 
-    # Convert in gray color
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Back to full resolution, with a margin absorbing the imprecision of
+    # the coarse contour
+    x, y, w, h = cv2.boundingRect(cnt)
+    margin = roi_margin * max(w, h) + 1
+    img_h, img_w = workspace.img.shape[:2]
+    x1 = max(int((x - margin) / coarse_scale), 0)
+    y1 = max(int((y - margin) / coarse_scale), 0)
+    x2 = min(int((x + w + margin) / coarse_scale) + 1, img_w)
+    y2 = min(int((y + h + margin) / coarse_scale) + 1, img_h)
+    return x1, y1, x2, y2
+
+
+def _card_contour(
+    workspace: FrameWorkspace,
+    roi: tuple,
+    min_area: float,
+    metrics: Metrics = None
+):
+    """Full resolution stage: find the contour of the card in the zone 'roi'
+    (x1, y1, x2, y2) of the frame of 'workspace'. The contour is in the
+    coordinates of the frame.
+
+    Returns:
+        tuple: contour (None if not found), filtered gray zone and edges
+    """
+    x1, y1 = roi[:2]
+    gray, edge = _edges(workspace, roi, metrics)
+
+    # Find the contours in the edged image. Since OpenCV 3.2, findContours
+    # does not modify its input, the edges are kept for the debug views
+    with _timed(metrics, "contours"):
+        cnt = _largest_contour(
+            edge,
+            min_area=min_area,
+            offset=(x1, y1)
+        )
+
+    return cnt, gray, edge
+
+
+def _edges(workspace: FrameWorkspace, roi: tuple, metrics: Metrics = None):
+    """Filtered gray image and edges of the zone 'roi' (x1, y1, x2, y2) of
+    the frame of 'workspace', views of its buffers
+    """
+    # Convert in gray color, unless already done for the focus
+    with _timed(metrics, "gray"):
+        workspace.gray()
 
     # Noise-reducing and edge-preserving filter
-    gray = cv2.bilateralFilter(gray, 11, 17, 17)
+    with _timed(metrics, "bilateral"):
+        gray = workspace.filtered(roi)
 
     # Edge extraction
-    edge = cv2.Canny(gray, 30, 200)
+    with _timed(metrics, "canny"):
+        edge = workspace.edges(gray)
 
-    # Find the contours in the edged image
-    cnts, _ = cv2.findContours(
-        edge.copy(),
-        cv2.RETR_EXTERNAL,
-        cv2.CHAIN_APPROX_SIMPLE
-    )
+    return gray, edge
 
-    # We suppose that the contour with largest area corresponds
-    # to the contour delimiting the card
-    cnt = sorted(cnts, key=cv2.contourArea, reverse=True)[0]
 
-    # We want to check that 'cnt' is the contour of a rectangular shape
+def _validate_contour(cnt):
+    """Check that 'cnt' is the contour of a rectangular shape
+
+    Returns:
+        tuple: validity flag, minimum area rectangle and its 4 corners
+    """
     # First, determine 'box', the minimum area bounding rectangle of 'cnt'
     # Then compare area of 'cnt' and area of 'box'
     # Both areas sould be very close
@@ -115,26 +199,39 @@ def extract_card(
     box = np.int0(box)
     areaCnt = cv2.contourArea(cnt)
     areaBox = cv2.contourArea(box)
-    valid = areaCnt / areaBox > 0.95
+    valid = areaBox > 0 and areaCnt / areaBox > 0.95
+    return valid, rect, box
 
-    if valid:
-        # We want transform the zone inside the contour into the reference
-        # rectangle of dimensions (cardW,cardH)
-        ((xr, yr), (wr, hr), thetar) = rect
-        # Determine 'Mp' the transformation that transforms 'box' into the
-        # reference rectangle
-        if wr > hr:
-            Mp = cv2.getPerspectiveTransform(
-                np.float32(box),
-                ref_card.card()
-            )
-        else:
-            Mp = cv2.getPerspectiveTransform(
-                np.float32(box),
-                ref_card.card_rotated()
-            )
-        # Determine the warped image by applying the transformation
-        # to the image
+
+def _warp_card(
+    img,
+    cnt,
+    rect,
+    box,
+    ref_card: ReferenceCard,
+    metrics: Metrics = None
+):
+    """Warp the zone of 'img' delimited by 'box' into the reference card,
+    and build its alpha channel from the contour 'cnt'
+    """
+    # We want transform the zone inside the contour into the reference
+    # rectangle of dimensions (cardW,cardH)
+    ((xr, yr), (wr, hr), thetar) = rect
+    # Determine 'Mp' the transformation that transforms 'box' into the
+    # reference rectangle
+    if wr > hr:
+        Mp = cv2.getPerspectiveTransform(
+            np.float32(box),
+            ref_card.card()
+        )
+    else:
+        Mp = cv2.getPerspectiveTransform(
+            np.float32(box),
+            ref_card.card_rotated()
+        )
+    # Determine the warped image by applying the transformation
+    # to the image
+    with _timed(metrics, "warp"):
         imgwarp = cv2.warpPerspective(
             img,
             Mp,
@@ -142,109 +239,1108 @@ def extract_card(
         )
         # Add alpha layer
         imgwarp = cv2.cvtColor(imgwarp, cv2.COLOR_BGR2BGRA)
+    with _timed(metrics, "alpha"):
+        # Add the alphachannel to the warped image
+        imgwarp[:, :, 3] = _alpha_channel(cnt, Mp, ref_card)
+    return imgwarp
 
-        # Shape of 'cnt' is (n,1,2), type = int with n  =  number of points
-        # We reshape into (1,n,2), type = float32, before
-        # feeding to perspectiveTransform
-        cnta = cnt.reshape(1, -1, 2).astype(np.float32)
-        # Apply the transformation 'Mp' to the contour
-        cntwarp = cv2.perspectiveTransform(cnta, Mp)
-        cntwarp = cntwarp.astype(np.int)
 
-        # We build the alpha channel so that we have transparency on the
-        # external border of the card
-        # First, initialize alpha channel fully transparent
-        alphachannel = np.zeros(imgwarp.shape[:2], dtype=np.uint8)
-        # Then fill in the contour to make opaque this zone of the card
-        cv2.drawContours(alphachannel, cntwarp, 0, 255, -1)
+def _alpha_channel(cnt, Mp, ref_card: ReferenceCard):
+    """Alpha channel of the warped card: opaque inside the contour 'cnt'
+    transformed by 'Mp', cleaned by the alpha mask of 'ref_card'
+    """
+    # Shape of 'cnt' is (n,1,2), type = int with n  =  number of points
+    # We reshape into (1,n,2), type = float32, before
+    # feeding to perspectiveTransform
+    cnta = cnt.reshape(1, -1, 2).astype(np.float32)
+    # Apply the transformation 'Mp' to the contour
+    cntwarp = cv2.perspectiveTransform(cnta, Mp)
+    cntwarp = cntwarp.astype(np.int)
 
-        # Apply the alphamask onto the alpha channel to clean it
-        alphachannel = cv2.bitwise_and(alphachannel, alphamask())
+    # We build the alpha channel so that we have transparency on the
+    # external border of the card
+    # First, initialize alpha channel fully transparent
+    alphachannel = np.zeros(
+        (ref_card.height, ref_card.width), dtype=np.uint8)
+    # Then fill in the contour to make opaque this zone of the card
+    cv2.drawContours(alphachannel, cntwarp, 0, 255, -1)
 
-        # Add the alphachannel to the warped image
-        imgwarp[:, :, 3] = alphachannel
+    # Apply the alphamask onto the alpha channel to clean it
+    cv2.bitwise_and(
+        alphachannel, ref_card.alphamask(), dst=alphachannel)
 
-        # Save the image to file
+    return alphachannel
+
+
+def _reject(debug: bool, metrics: Metrics, reason: str, *details):
+    """Result of 'extract_card' for a frame without valid card, counted
+    as "rejected_<reason>" in 'metrics'
+    """
+    _count(metrics, "rejected_" + reason)
+    if debug:
+        print(reason.replace("_", " ").capitalize(), *details)
+    return False, None
+
+
+def _write_card(output_path: str, imgwarp, writer: CardWriter = None):
+    """Save the card 'imgwarp', asynchronously if 'writer' is specified"""
+    if writer is not None:
+        writer.write(output_path, imgwarp)
+    else:
         cv2.imwrite(output_path, imgwarp)
 
+
+def _show_debug(img, gray, edge, cnt, box, imgwarp):
+    """Display the intermediate images of 'extract_card'"""
+    cv2.imshow("Gray", gray)
+    cv2.imshow("Canny", edge)
+    img_cnt = img.copy()
+    cv2.drawContours(img_cnt, [box], 0, (0, 0, 255), 3)
+    cv2.drawContours(img_cnt, [cnt], 0, (0, 255, 0), -1)
+    cv2.imshow("Contour with biggest area", img_cnt)
+    if imgwarp is not None:
+        cv2.imshow("Alphachannel", imgwarp[:, :, 3])
+        cv2.imshow("Extracted card", imgwarp)
+
+
+def extract_card(
+        img,
+        output_path=None,
+        ref_card: ReferenceCard = ReferenceCard(),
+        min_focus=120,
+        debug=False,
+        focus=None,
+        coarse_scale=None,
+        roi_margin=0.1,
+        min_card_area=0.01,
+        metrics: Metrics = None,
+        writer: CardWriter = None,
+        workspace: FrameWorkspace = None
+):
+    """Extract the card shown in the BGR image 'img'
+
+    If 'coarse_scale' is specified, the detection runs as a cascade: the
+    focus is measured and the card is roughly located on the image
+    downscaled by 'coarse_scale', then the costly bilateral filter, Canny
+    and contour search only run at full resolution in the zone around the
+    rough card location. Note that 'min_focus' then applies to the focus
+    of the downscaled image, see 'frame_focus'.
+
+    Args:
+        img (np.array): BGR image
+        output_path (str, optional): if specified, the extracted card is
+            saved to this path. Defaults to None.
+        ref_card (ReferenceCard, optional): reference card geometry.
+            Defaults to ReferenceCard().
+        min_focus (int, optional): images with a focus below 'min_focus'
+            are rejected. Defaults to 120.
+        debug (bool, optional): display intermediate images.
+            Defaults to False.
+        focus (float, optional): focus of 'img' if already computed by the
+            caller with 'frame_focus'. Defaults to None.
+        coarse_scale (float, optional): scale of the downscaled image used
+            by the first stage of the cascade, e.g. 0.25. Defaults to None
+            (no cascade).
+        roi_margin (float, optional): margin added around the rough card
+            location, relative to its size. Defaults to 0.1.
+        min_card_area (float, optional): contours smaller than this
+            fraction of the image area are not considered as card
+            candidates. Defaults to 0.01.
+        metrics (Metrics, optional): if specified, the time spent in each
+            stage and the reason of a rejection are recorded in it.
+            Defaults to None.
+        writer (CardWriter, optional): if specified, the card is saved to
+            'output_path' asynchronously by 'writer'. Defaults to None.
+        workspace (FrameWorkspace, optional): workspace loaded with 'img',
+            e.g. by the caller which measured its focus. Defaults to None
+            (workspace of the calling thread, see 'thread_workspace').
+
+    Returns:
+        tuple: validity flag and extracted BGRA card (None if not valid, in
+            particular if no card candidate is found)
+    """
+    imgwarp = None
+    _count(metrics, "frames")
+    if workspace is None:
+        workspace = thread_workspace(img)
+    # Check the image is not too blurry
+    if focus is None:
+        with _timed(metrics, "focus"):
+            focus = frame_focus(img, coarse_scale, workspace)
+    if focus < min_focus:
+        return _reject(debug, metrics, "low_focus", focus)
+
+    # Zone of the image where the card is searched at full resolution
+    roi = 0, 0, img.shape[1], img.shape[0]
+    if coarse_scale is not None:
+        with _timed(metrics, "coarse"):
+            roi = _coarse_roi(
+                workspace, coarse_scale, roi_margin, min_card_area)
+        if roi is None:
+            return _reject(debug, metrics, "no_contour")
+
+    cnt, gray, edge = _card_contour(
+        workspace,
+        roi,
+        min_card_area * img.shape[0] * img.shape[1],
+        metrics
+    )
+    if cnt is None:
+        return _reject(debug, metrics, "no_contour")
+
+    with _timed(metrics, "validate"):
+        valid, rect, box = _validate_contour(cnt)
+
+    if not valid:
+        _reject(debug, metrics, "not_rectangular")
+    else:
+        imgwarp = _warp_card(img, cnt, rect, box, ref_card, metrics)
+        _count(metrics, "cards")
+
+        # Save the image to file
+        if output_path is not None:
+            with _timed(metrics, "write"):
+                _write_card(output_path, imgwarp, writer)
+
     if debug:
-        cv2.imshow("Gray", gray)
-        cv2.imshow("Canny", edge)
-        edge_bgr = cv2.cvtColor(edge, cv2.COLOR_GRAY2BGR)
-        cv2.drawContours(edge_bgr, [box], 0, (0, 0, 255), 3)
-        cv2.drawContours(edge_bgr, [cnt], 0, (0, 255, 0), -1)
-        cv2.imshow("Contour with biggest area", edge_bgr)
-        if valid:
-            cv2.imshow("Alphachannel", alphachannel)
-            cv2.imshow("Extracted card", imgwarp)
+        _show_debug(img, gray, edge, cnt, box, imgwarp)
 
     return valid, imgwarp
 
 
-def extract_cards_from_video(
+def _card_contours(edge, min_area: float = 0):
+    """External contours of the edge image 'edge' with an area of at least
+    'min_area', by decreasing area
+    """
+    cnts, _ = cv2.findContours(
+        edge,
+        cv2.RETR_EXTERNAL,
+        cv2.CHAIN_APPROX_SIMPLE
+    )
+    areas = [cv2.contourArea(cnt) for cnt in cnts]
+    order = sorted(
+        (i for i, area in enumerate(areas) if area >= min_area),
+        key=lambda i: -areas[i]
+    )
+    return [cnts[i] for i in order]
+
+
+def _overlap(rect1, rect2):
+    """Area of the intersection of the rotated rectangles 'rect1' and
+    'rect2', relative to the area of the smallest one
+    """
+    ret, pts = cv2.rotatedRectangleIntersection(rect1, rect2)
+    if ret == cv2.INTERSECT_NONE or pts is None:
+        return 0
+    inter = cv2.contourArea(cv2.convexHull(pts))
+    smallest = min(
+        rect1[1][0] * rect1[1][1],
+        rect2[1][0] * rect2[1][1]
+    )
+    return inter / smallest if smallest > 0 else 1
+
+
+def _accept_contours(
+    cnts: list,
+    max_overlap: float,
+    max_cards: int = None,
+    metrics: Metrics = None,
+    debug: bool = False
+):
+    """Validate the candidate contours 'cnts' by decreasing area, rejecting
+    the ones overlapping an already accepted card, see 'extract_cards'
+
+    Returns:
+        list: contour, minimum area rectangle and its corners of the
+            accepted cards
+    """
+    accepted = []
+    for cnt in cnts:
+        if max_cards is not None and len(accepted) >= max_cards:
+            break
+        with _timed(metrics, "validate"):
+            valid, rect, box = _validate_contour(cnt)
+        if not valid:
+            _reject(debug, metrics, "not_rectangular")
+        elif any(_overlap(rect, r) > max_overlap for _, r, _ in accepted):
+            _reject(debug, metrics, "overlap")
+        else:
+            accepted.append((cnt, rect, box))
+    return accepted
+
+
+def extract_cards(
+        img,
+        ref_card: ReferenceCard = ReferenceCard(),
+        min_focus=120,
+        focus=None,
+        min_card_area=0.01,
+        max_overlap=0.1,
+        max_cards=None,
+        metrics: Metrics = None,
+        debug=False,
+        workspace: FrameWorkspace = None
+):
+    """Extract all the cards shown in the BGR image 'img'
+
+    Same as 'extract_card', but instead of keeping the largest contour
+    only, every external contour of the edge image is a card candidate.
+    The costly filtering, Canny and contour search are done once for the
+    whole frame. The candidates are validated with the area ratio test,
+    then accepted by decreasing area: a candidate overlapping an already
+    accepted card is rejected. The accepted cards are finally warped.
+
+    Args:
+        img (np.array): BGR image
+        ref_card (ReferenceCard, optional): reference card geometry.
+            Defaults to ReferenceCard().
+        min_focus (int, optional): images with a focus below 'min_focus'
+            are rejected. Defaults to 120.
+        focus (float, optional): focus of 'img' if already computed by the
+            caller with 'frame_focus'. Defaults to None.
+        min_card_area (float, optional): contours smaller than this
+            fraction of the image area are not considered as card
+            candidates. Defaults to 0.01.
+        max_overlap (float, optional): a candidate is rejected if its
+            intersection with an accepted card exceeds this fraction of the
+            area of the smallest of both. Defaults to 0.1.
+        max_cards (int, optional): maximal number of extracted cards.
+            Defaults to None (no limit).
+        metrics (Metrics, optional): if specified, the time spent in each
+            stage and the reasons of the rejections are recorded in it.
+            Defaults to None.
+        debug (bool, optional): display intermediate images.
+            Defaults to False.
+        workspace (FrameWorkspace, optional): see 'extract_card'.
+            Defaults to None.
+
+    Returns:
+        list: (BGRA card, 4 corners of the card in 'img') of every
+            extracted card, by decreasing area
+    """
+    _count(metrics, "frames")
+    if workspace is None:
+        workspace = thread_workspace(img)
+    if focus is None:
+        with _timed(metrics, "focus"):
+            focus = frame_focus(img, workspace=workspace)
+    if focus < min_focus:
+        _reject(debug, metrics, "low_focus", focus)
+        return []
+
+    roi = 0, 0, img.shape[1], img.shape[0]
+    gray, edge = _edges(workspace, roi, metrics)
+    with _timed(metrics, "contours"):
+        cnts = _card_contours(
+            edge, min_card_area * img.shape[0] * img.shape[1])
+    if not cnts:
+        _reject(debug, metrics, "no_contour")
+
+    cards = []
+    for cnt, rect, box in _accept_contours(
+            cnts, max_overlap, max_cards, metrics, debug):
+        cards.append((_warp_card(img, cnt, rect, box, ref_card, metrics), box))
+        _count(metrics, "cards")
+
+    if debug:
+        _show_debug_cards(img, gray, edge, cards)
+
+    return cards
+
+
+def _show_debug_cards(img, gray, edge, cards: list):
+    """Display the intermediate images of 'extract_cards'"""
+    cv2.imshow("Gray", gray)
+    cv2.imshow("Canny", edge)
+    img_cnt = img.copy()
+    cv2.drawContours(img_cnt, [box for _, box in cards], -1, (0, 0, 255), 3)
+    cv2.imshow("Extracted cards", img_cnt)
+    for i, (imgwarp, _) in enumerate(cards):
+        cv2.imshow(f"Extracted card {i}", imgwarp)
+
+
+class CardTracker():
+    """Extract the card of consecutive frames of a video, tracking it from
+    one frame to the next
+
+    Once a card is found, the card of the next frame is searched in a small
+    zone around its previous minimum area rectangle only: the bilateral
+    filter, Canny and contour search run on this zone instead of the whole
+    frame. The tracked card is trusted if it is still a rectangle, of about
+    the same area, not cut by the border of the zone. Otherwise, the card
+    is detected again in the whole frame, like 'extract_card' does.
+
+    A tracker holds the state of one video: frames must be fed in order,
+    from a single thread.
+    """
+
+    def __init__(
+        self,
+        ref_card: ReferenceCard = ReferenceCard(),
+        min_focus: float = 120,
+        coarse_scale: float = None,
+        roi_margin: float = 0.1,
+        min_card_area: float = 0.01,
+        track_margin: float = 0.15,
+        max_area_change: float = 0.15
+    ):
+        """
+        Args:
+            ref_card (ReferenceCard, optional): reference card geometry.
+                Defaults to ReferenceCard().
+            min_focus (float, optional): frames with a focus below
+                'min_focus' are rejected. Defaults to 120.
+            coarse_scale (float, optional): see 'extract_card', used by the
+                full detection. Defaults to None.
+            roi_margin (float, optional): see 'extract_card'.
+                Defaults to 0.1.
+            min_card_area (float, optional): see 'extract_card'.
+                Defaults to 0.01.
+            track_margin (float, optional): margin added around the
+                previous card to get the zone where it is tracked, relative
+                to its size. Defaults to 0.15.
+            max_area_change (float, optional): maximal relative change of
+                the area of a tracked card between 2 frames.
+                Defaults to 0.15.
+        """
+        self.ref_card = ref_card
+        self.min_focus = min_focus
+        self.coarse_scale = coarse_scale
+        self.roi_margin = roi_margin
+        self.min_card_area = min_card_area
+        self.track_margin = track_margin
+        self.max_area_change = max_area_change
+        self.reset()
+
+    def reset(self):
+        """Forget the tracked card, the next frame is fully searched"""
+        self._box = None
+        self._area = None
+
+    def _roi(self, shape: tuple):
+        """Zone (x1, y1, x2, y2) around the previous card"""
+        x, y, w, h = cv2.boundingRect(self._box)
+        margin = self.track_margin * max(w, h) + 1
+        img_h, img_w = shape[:2]
+        return (
+            max(int(x - margin), 0),
+            max(int(y - margin), 0),
+            min(int(x + w + margin) + 1, img_w),
+            min(int(y + h + margin) + 1, img_h)
+        )
+
+    def _consistent(self, cnt, rect, roi: tuple, shape: tuple):
+        """Whether the card found in the zone 'roi' is the tracked card:
+        of about the same area and not cut by the border of the zone
+        """
+        area = rect[1][0] * rect[1][1]
+        if abs(area - self._area) > self.max_area_change * self._area:
+            return False
+        x, y, w, h = cv2.boundingRect(cnt)
+        x1, y1, x2, y2 = roi
+        img_h, img_w = shape[:2]
+        return (x > x1 or x1 == 0) and (y > y1 or y1 == 0) \
+            and (x + w < x2 or x2 == img_w) and (y + h < y2 or y2 == img_h)
+
+    def _track(
+        self,
+        workspace: FrameWorkspace,
+        min_area: float,
+        metrics: Metrics = None
+    ):
+        """Search the card around its previous location
+
+        Returns:
+            tuple: contour, minimum area rectangle and its corners, None if
+                the card is lost
+        """
+        shape = workspace.img.shape
+        roi = self._roi(shape)
+        cnt, _, _ = _card_contour(workspace, roi, min_area, metrics)
+        if cnt is None:
+            return None
+        with _timed(metrics, "validate"):
+            valid, rect, box = _validate_contour(cnt)
+        if not valid or not self._consistent(cnt, rect, roi, shape):
+            return None
+        return cnt, rect, box
+
+    def _detect(
+        self,
+        workspace: FrameWorkspace,
+        min_area: float,
+        metrics: Metrics = None
+    ):
+        """Search the card in the whole frame, see 'extract_card'
+
+        Returns:
+            tuple: contour, minimum area rectangle and its corners, None if
+                no card is found
+        """
+        roi = 0, 0, workspace.img.shape[1], workspace.img.shape[0]
+        if self.coarse_scale is not None:
+            with _timed(metrics, "coarse"):
+                roi = _coarse_roi(
+                    workspace, self.coarse_scale, self.roi_margin,
+                    self.min_card_area)
+            if roi is None:
+                _count(metrics, "rejected_no_contour")
+                return None
+        cnt, _, _ = _card_contour(workspace, roi, min_area, metrics)
+        if cnt is None:
+            _count(metrics, "rejected_no_contour")
+            return None
+        with _timed(metrics, "validate"):
+            valid, rect, box = _validate_contour(cnt)
+        if not valid:
+            _count(metrics, "rejected_not_rectangular")
+            return None
+        return cnt, rect, box
+
+    def extract_card(
+        self,
+        img,
+        focus: float = None,
+        metrics: Metrics = None,
+        workspace: FrameWorkspace = None
+    ):
+        """Extract the card shown in the BGR frame 'img', the next frame of
+        the video
+
+        Args:
+            img (np.array): BGR image
+            focus (float, optional): focus of 'img' if already computed by
+                the caller with 'frame_focus'. Defaults to None.
+            metrics (Metrics, optional): if specified, the time spent in
+                each stage, the reasons of the rejections and the number of
+                tracked and lost cards are recorded in it. Defaults to None.
+            workspace (FrameWorkspace, optional): see 'extract_card'.
+                Defaults to None.
+
+        Returns:
+            tuple: validity flag and extracted BGRA card (None if not valid)
+        """
+        _count(metrics, "frames")
+        if workspace is None:
+            workspace = thread_workspace(img)
+        if focus is None:
+            with _timed(metrics, "focus"):
+                focus = frame_focus(img, self.coarse_scale, workspace)
+        # A blurry frame does not tell where the card is, the tracked card
+        # is kept for the next frame
+        if focus < self.min_focus:
+            return _reject(False, metrics, "low_focus")
+
+        min_area = self.min_card_area * img.shape[0] * img.shape[1]
+        found = None
+        if self._box is not None:
+            found = self._track(workspace, min_area, metrics)
+            _count(metrics, "tracked" if found else "tracking_lost")
+        if found is None:
+            found = self._detect(workspace, min_area, metrics)
+        if found is None:
+            self.reset()
+            return False, None
+
+        cnt, rect, box = found
+        self._box = box
+        self._area = rect[1][0] * rect[1][1]
+        _count(metrics, "cards")
+        return True, _warp_card(img, cnt, rect, box, self.ref_card, metrics)
+
+
+def _decode_frames(
+    cap: cv2.VideoCapture,
+    keep_ratio: int,
+    frames: queue.Queue,
+    stop: threading.Event,
+    selected: set = None
+):
+    """Decode one every 'keep_ratio' frames of 'cap' into the queue 'frames'
+
+    Skipped frames are only grabbed (demuxed), the costly decoding into an
+    image is done by 'retrieve' for the kept frames only. A final None is
+    put in the queue once the video is exhausted.
+
+    Args:
+        cap (cv2.VideoCapture): opened video
+        keep_ratio (int): one frame every 'keep_ratio' frames is decoded
+        frames (queue.Queue): bounded queue receiving (frame_nb, img)
+        stop (threading.Event): set by the consumer to stop decoding early
+        selected (set, optional): if specified, only the frames with these
+            numbers are decoded. Defaults to None.
+    """
+    frame_nb = 0
+    item = None
+    while not stop.is_set():
+        if item is None:
+            if not cap.grab():
+                break
+            if frame_nb % keep_ratio == 0 \
+                    and (selected is None or frame_nb in selected):
+                ret, img = cap.retrieve()
+                if not ret:
+                    break
+                item = (frame_nb, img)
+            frame_nb += 1
+            if item is None:
+                continue
+        # Wait for room in the queue, but keep an eye on 'stop'
+        try:
+            frames.put(item, timeout=0.1)
+            item = None
+        except queue.Full:
+            pass
+    frames.put(None)
+
+
+def read_frames(
     video_file: str,
+    keep_ratio: int = 1,
+    queue_size: int = 32,
+    selected: set = None
+):
+    """Iterate over one every 'keep_ratio' frames of 'video_file'
+
+    The frames are decoded on a background thread which feeds a bounded
+    queue, so that decoding overlaps with the processing of the frames
+    while the memory used by decoded frames stays bounded.
+
+    Args:
+        video_file (str): path of the video
+        keep_ratio (int, optional): one frame every 'keep_ratio' frames is
+            decoded. Defaults to 1.
+        queue_size (int, optional): maximum number of decoded frames waiting
+            to be processed. Defaults to 32.
+        selected (set, optional): if specified, only the frames with these
+            numbers are decoded, the others are only grabbed.
+            Defaults to None.
+
+    Yields:
+        tuple: frame number and decoded BGR image
+    """
+    cap = cv2.VideoCapture(video_file)
+    frames = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    decoder = threading.Thread(
+        target=_decode_frames,
+        args=(cap, keep_ratio, frames, stop, selected),
+        daemon=True
+    )
+    decoder.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            yield item
+    finally:
+        stop.set()
+        # Unblock the decoder if it is waiting on a full queue
+        while decoder.is_alive():
+            try:
+                frames.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        cap.release()
+
+
+def _map_in_threads(func, items, workers: int):
+    """Apply 'func' to every tuple of 'items' using 'workers' threads
+
+    Contrary to 'ThreadPoolExecutor.map', 'items' is consumed lazily: at most
+    2 * 'workers' items are in flight, which bounds the memory used when
+    'items' is a stream of frames. Results are yielded in input order.
+
+    Args:
+        func (callable): function called as func(*item)
+        items (iterable): tuples of arguments
+        workers (int): number of threads
+
+    Yields:
+        result of 'func' for each item
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, *item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _measure_focus(coarse_scale: float, frame_nb: int, img):
+    """Focus of the frame 'img', see 'frame_focus'
+
+    Returns:
+        tuple: frame number, image, focus and metrics of the frame
+    """
+    frame_metrics = Metrics()
+    with _timed(frame_metrics, "focus"):
+        focus = frame_focus(img, coarse_scale)
+    return frame_nb, img, focus, frame_metrics
+
+
+def _gate_out(frame_metrics: Metrics, metrics: Metrics):
+    """Count a frame rejected by the focus gate into 'metrics'"""
+    frame_metrics.count("frames")
+    frame_metrics.count("rejected_low_focus")
+    metrics.merge(frame_metrics)
+
+
+def _adaptive_frames(frames, gate: FocusGate, metrics: Metrics):
+    """Frames of the stream 'frames' of (frame number, image, focus,
+    metrics) admitted by 'gate', in order
+    """
+    for frame_nb, img, focus, frame_metrics in frames:
+        if gate.admit(focus):
+            yield frame_nb, img, focus, frame_metrics
+        else:
+            _gate_out(frame_metrics, metrics)
+
+
+def _two_pass_frames(
+    video_file: str,
+    measure,
+    workers: int,
+    top_ratio: float,
+    metrics: Metrics,
+    **kwargs
+):
+    """A first pass measures the focus of every frame of 'video_file', then
+    a second pass decodes the sharpest frames only, see 'top_focus_threshold'
+
+    Yields:
+        tuple: frame number, image, focus and metrics of the frame
+    """
+    frames = read_frames(video_file, **kwargs)
+    try:
+        # The images are dropped once their focus is measured
+        focuses = {}
+        for frame_nb, _, focus, frame_metrics in _map_in_threads(
+                measure, frames, workers):
+            focuses[frame_nb] = focus
+            metrics.merge(frame_metrics)
+    finally:
+        frames.close()
+    threshold = top_focus_threshold(list(focuses.values()), top_ratio)
+    selected = set()
+    for frame_nb, focus in focuses.items():
+        if focus >= threshold:
+            selected.add(frame_nb)
+        else:
+            _gate_out(Metrics(), metrics)
+
+    frames = read_frames(video_file, selected=selected, **kwargs)
+    try:
+        for frame_nb, img in frames:
+            yield frame_nb, img, focuses[frame_nb], Metrics()
+    finally:
+        frames.close()
+
+
+def _focused_frames(
+    video_file: str,
+    focus_mode: str,
+    top_ratio: float,
+    coarse_scale: float,
+    workers: int,
+    metrics: Metrics,
+    **kwargs
+):
+    """Frames of 'video_file' to process, depending on 'focus_mode', see
+    'iter_cards_from_video'
+
+    Yields:
+        tuple: frame number and image, with the focus and metrics of the
+            frame if they are already known, i.e. unless 'focus_mode' is
+            "fixed"
+    """
+    if focus_mode == "fixed":
+        # The focus is measured by the extraction, in the same workspace
+        return read_frames(video_file, **kwargs)
+    measure = partial(_measure_focus, coarse_scale)
+    if focus_mode == "two_pass":
+        return _two_pass_frames(
+            video_file, measure, workers, top_ratio, metrics, **kwargs)
+    return _adaptive_frames(
+        _map_in_threads(measure, read_frames(video_file, **kwargs), workers),
+        FocusGate(top_ratio),
+        metrics
+    )
+
+
+def _process_frame(
+    extract,
+    coarse_scale: float,
+    max_distance: int,
+    frame_nb: int,
+    img,
+    focus: float = None,
+    frame_metrics: Metrics = None
+):
+    """Extract the card of a frame with 'extract', see '_frame_extractor',
+    measuring its focus first if not specified
+
+    Returns:
+        tuple: (hash, frame number, focus, card) or None if no card is
+            extracted, and metrics of the frame
+    """
+    # Metrics are collected per frame, as frames are processed concurrently
+    if frame_metrics is None:
+        frame_metrics = Metrics()
+    # The gray images of the frame are shared by the focus measure and the
+    # extraction, in the buffers of the thread
+    workspace = thread_workspace(img)
+    if focus is None:
+        with _timed(frame_metrics, "focus"):
+            focus = frame_focus(img, coarse_scale, workspace)
+    valid, card_img = extract(
+        img, focus=focus, metrics=frame_metrics, workspace=workspace)
+    if not valid:
+        return None, frame_metrics
+    hash_ = None
+    if max_distance is not None:
+        with _timed(frame_metrics, "hash"):
+            hash_ = card_hash(card_img)
+    return (hash_, frame_nb, focus, card_img), frame_metrics
+
+
+def _reset_dir(path: str):
+    """Create the directory 'path', removing its previous content"""
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+
+def _frame_extractor(track: bool, debug: bool = False, **kwargs):
+    """Function extracting the card of a frame, called as
+    extract(img, focus=..., metrics=..., workspace=...): 'extract_card',
+    or the 'extract_card' method of a new 'CardTracker' if 'track' is True
+
+    Args:
+        track (bool): track the card along the frames
+        debug (bool, optional): see 'extract_card'. Defaults to False.
+        **kwargs: 'ref_card', 'min_focus', 'coarse_scale' and 'roi_margin'
+    """
+    if track:
+        return CardTracker(**kwargs).extract_card
+    return partial(extract_card, debug=debug, **kwargs)
+
+
+def _save_card(
+    writer: CardWriter,
     output_dir: str,
+    card_img: np.array,
+    metrics: Metrics
+):
+    """Save 'card_img' in 'output_dir' with a random file name, nothing is
+    saved if 'output_dir' is None
+    """
+    if output_dir is None:
+        return
+    with _timed(metrics, "write"):
+        writer.write(
+            os.path.join(output_dir, str(uuid4()) + writer.extension),
+            card_img
+        )
+
+
+def _valid_cards(results, metrics: Metrics):
+    """Cards of the (card, metrics) results of the frames, merging the
+    frame metrics into 'metrics'
+    """
+    for card, frame_metrics in results:
+        metrics.merge(frame_metrics)
+        if card is not None:
+            yield card
+
+
+def _record_video(
+    metrics: Metrics,
+    video_metrics: Metrics,
+    video_file: str,
+    nb_cards: int,
+    seconds: float
+):
+    """Merge the metrics of the video 'video_file' into 'metrics', if not
+    None, with the statistics of the video
+    """
+    if metrics is None:
+        return
+    video_metrics.count("cards_kept", nb_cards)
+    video_metrics.add_video(
+        video_file,
+        video_metrics.counters.get("frames", 0),
+        nb_cards,
+        seconds
+    )
+    metrics.merge(video_metrics)
+
+
+def _select_cards(cards, max_distance: int = None):
+    """Suppress the near-duplicates of the stream 'cards' of (hash, frame
+    number, focus, card) tuples, see 'NearDuplicateFilter'
+
+    Yields:
+        tuple: frame number, focus and card of the selected cards
+    """
+    if max_distance is None:
+        for item in cards:
+            yield item[1:]
+        return
+    selector = NearDuplicateFilter(max_distance)
+    for item in cards:
+        selected = selector.push(item[0], item[2], item[1:])
+        if selected is not None:
+            yield selected
+    selected = selector.flush()
+    if selected is not None:
+        yield selected
+
+
+def iter_cards_from_video(
+    video_file: str,
+    output_dir: str = None,
     ref_card: ReferenceCard = ReferenceCard(),
     keep_ratio: int = 5,
     min_focus: int = 120,
+    workers: int = 1,
+    queue_size: int = 32,
+    coarse_scale: float = None,
+    roi_margin: float = 0.1,
+    metrics: Metrics = None,
+    writer: CardWriter = None,
+    max_distance: int = None,
+    track: bool = False,
+    focus_mode: str = "fixed",
+    top_ratio: float = 0.2,
     debug: bool = False
 ):
-    """Extract cards from media file 'video_file'
+    """Iterate over the cards extracted from media file 'video_file'
         If 'output_dir' is specified, the cards are saved in 'output_dir'.
         One file per card with a random file name
         Because 2 consecutives frames are probably very similar, we don't use
         every frame of the video,
         but only one every 'keep_ratio' frames
 
-        Returns list of extracted images
+        Frames are decoded on a dedicated thread and handed over to
+        'workers' threads running 'extract_card'. Cards are yielded as soon
+        as they are extracted, so memory does not grow with the length of
+        the video. Cards are written by a 'CardWriter', in the background.
+
+        If 'max_distance' is specified, near-duplicate cards are suppressed:
+        of every run of similar consecutive cards, only the sharpest one is
+        kept, see 'NearDuplicateFilter'. A low 'keep_ratio' can then be used
+        without flooding the dataset with identical cards.
+
+        If 'track' is True, the card is tracked from one frame to the next
+        by a 'CardTracker', which is much cheaper than searching the whole
+        frame, but requires to process the frames in order, on one thread.
+
+        The frames are gated by their focus according to 'focus_mode':
+        - "fixed": the frames with a focus below 'min_focus' are rejected
+        - "adaptive": a frame is processed if it is among the 'top_ratio'
+          sharpest frames seen so far, see 'FocusGate'. The threshold
+          adapts to every video, dim or sharp.
+        - "two_pass": a first pass over the video measures the focus of
+          every frame, then a second pass decodes and processes the
+          'top_ratio' sharpest frames only.
+        In both adaptive modes, 'min_focus' is not used, and the focus is
+        measured on threads ahead of the extraction, the gating decisions
+        being taken in frame order.
 
     Args:
-        video_file ([type]): [description]
-        output_dir ([type], optional): [description]. Defaults to None.
-        keep_ratio (int, optional): [description]. Defaults to 5.
-        min_focus (int, optional): [description]. Defaults to 120.
-        debug (bool, optional): [description]. Defaults to False.
+        video_file (str): path of the video
+        output_dir (str, optional): directory where the cards are saved.
+            Defaults to None.
+        ref_card (ReferenceCard, optional): reference card geometry.
+            Defaults to ReferenceCard().
+        keep_ratio (int, optional): one frame every 'keep_ratio' frames is
+            processed. Defaults to 5.
+        min_focus (int, optional): minimal focus of a processed frame.
+            Defaults to 120.
+        workers (int, optional): number of threads running 'extract_card'.
+            Forced to 1 in debug mode. Defaults to 1.
+        queue_size (int, optional): maximum number of decoded frames waiting
+            to be processed. Defaults to 32.
+        coarse_scale (float, optional): see 'extract_card'.
+            Defaults to None.
+        roi_margin (float, optional): see 'extract_card'. Defaults to 0.1.
+        metrics (Metrics, optional): if specified, the stage timers and
+            reject counters of 'extract_card', and the statistics of the
+            video (frames per second, ...) are recorded in it.
+            Defaults to None.
+        writer (CardWriter, optional): writer saving the cards in
+            'output_dir'. If not specified, a default 'CardWriter' is
+            created and closed once the video is processed.
+            Defaults to None.
+        max_distance (int, optional): maximal number of differing bits
+            between the hashes of 2 near-duplicate cards, see 'card_hash'.
+            Defaults to None (no suppression).
+        track (bool, optional): track the card along the frames, see
+            'CardTracker'. Forces 'workers' to 1. Defaults to False.
+        focus_mode (str, optional): one of 'FOCUS_MODES'.
+            Defaults to "fixed".
+        top_ratio (float, optional): fraction of the sharpest frames
+            processed in the adaptive modes. Defaults to 0.2.
+        debug (bool, optional): display intermediate images, not
+            available when tracking. Defaults to False.
 
-    Returns:
-        [type]: [description]
+    Yields:
+        tuple: frame number, focus and extracted BGRA card
     """
+    if focus_mode not in FOCUS_MODES:
+        raise ValueError(f"Unknown focus mode {focus_mode}")
     if not os.path.isfile(video_file):
         print(f"Video file {video_file} does not exist !!!")
-        return -1, []
+        return
+
+    own_writer = None
+    if output_dir is not None:
+        _reset_dir(output_dir)
+        if writer is None:
+            writer = own_writer = CardWriter()
 
-    if os.path.exists(output_dir):
-        shutil.rmtree(output_dir)
+    extract = _frame_extractor(
+        track,
+        ref_card=ref_card,
+        # The adaptive modes gate the frames before the extraction
+        min_focus=min_focus if focus_mode == "fixed" else 0,
+        coarse_scale=coarse_scale,
+        roi_margin=roi_margin,
+        debug=debug
+    )
 
-    os.makedirs(output_dir)
+    process = partial(_process_frame, extract, coarse_scale, max_distance)
 
-    cap = cv2.VideoCapture(video_file)
+    # The frames must be tracked in order
+    if debug or track:
+        workers = 1
 
-    frame_nb = 0
-    imgs_list = []
-    while True:
-        ret, img = cap.read()
-        if not ret:
-            break
-        # Work on every 'keep_ratio' frames
-        if frame_nb % keep_ratio == 0:
-            output_path = os.path.join(output_dir, str(uuid4()) + ".png")
-            valid, card_img = extract_card(
-                img,
-                output_path,
-                ref_card=ref_card,
-                min_focus=min_focus,
-                debug=debug
-            )
-
-            if valid:
-                imgs_list.append(card_img)
-        frame_nb += 1
+    video_metrics = Metrics()
+    nb_cards = 0
+    start = time.perf_counter()
+    frames = _focused_frames(
+        video_file,
+        focus_mode,
+        top_ratio,
+        coarse_scale,
+        workers,
+        video_metrics,
+        keep_ratio=keep_ratio,
+        queue_size=queue_size
+    )
+    try:
+        # Cards are only written once selected
+        for frame_nb, focus, card_img in _select_cards(
+                _valid_cards(
+                    _map_in_threads(process, frames, workers),
+                    video_metrics),
+                max_distance):
+            _save_card(writer, output_dir, card_img, video_metrics)
+            nb_cards += 1
+            yield frame_nb, focus, card_img
+    finally:
+        frames.close()
+        _record_video(
+            metrics,
+            video_metrics,
+            video_file,
+            nb_cards,
+            time.perf_counter() - start
+        )
+        if own_writer is not None:
+            own_writer.close()
+        if debug:
+            cv2.destroyAllWindows()
 
-    if debug:
-        cap.release()
-        cv2.destroyAllWindows()
 
-    return imgs_list
+def count_cards_from_video(video_file: str, output_dir: str, **kwargs):
+    """Extract the cards of 'video_file' into 'output_dir' and count them,
+        without keeping the extracted images in memory
+
+    Args:
+        video_file (str): path of the video
+        output_dir (str): directory where the cards are saved
+        **kwargs: other arguments of 'iter_cards_from_video'
+
+    Returns:
+        int: number of extracted cards
+    """
+    return sum(
+        1 for _ in iter_cards_from_video(video_file, output_dir, **kwargs))
+
+
+def extract_cards_from_video(
+    video_file: str,
+    output_dir: str,
+    ref_card: ReferenceCard = ReferenceCard(),
+    keep_ratio: int = 5,
+    min_focus: int = 120,
+    workers: int = 1,
+    queue_size: int = 32,
+    max_distance: int = None,
+    track: bool = False,
+    focus_mode: str = "fixed",
+    top_ratio: float = 0.2,
+    debug: bool = False
+):
+    """Extract cards from media file 'video_file', see
+        'iter_cards_from_video'
+
+        Returns list of extracted images. Prefer 'iter_cards_from_video' or
+        'count_cards_from_video' for long videos.
+
+    Args:
+        video_file (str): path of the video
+        output_dir (str): directory where the cards are saved
+        ref_card (ReferenceCard, optional): reference card geometry.
+            Defaults to ReferenceCard().
+        keep_ratio (int, optional): one frame every 'keep_ratio' frames is
+            processed. Defaults to 5.
+        min_focus (int, optional): minimal focus of a processed frame.
+            Defaults to 120.
+        workers (int, optional): number of threads running 'extract_card'.
+            Defaults to 1.
+        queue_size (int, optional): maximum number of decoded frames waiting
+            to be processed. Defaults to 32.
+        max_distance (int, optional): if specified, near-duplicate cards
+            are suppressed, see 'iter_cards_from_video'. Defaults to None.
+        track (bool, optional): track the card along the frames, see
+            'iter_cards_from_video'. Defaults to False.
+        focus_mode (str, optional): gating of the frames by their focus,
+            see 'iter_cards_from_video'. Defaults to "fixed".
+        top_ratio (float, optional): see 'iter_cards_from_video'.
+            Defaults to 0.2.
+        debug (bool, optional): display intermediate images.
+            Defaults to False.
+
+    Returns:
+        list: extracted card images
+    """
+    if not os.path.isfile(video_file):
+        print(f"Video file {video_file} does not exist !!!")
+        return -1, []
+
+    return [
+        card_img
+        for _, _, card_img in iter_cards_from_video(
+            video_file,
+            output_dir,
+            ref_card=ref_card,
+            keep_ratio=keep_ratio,
+            min_focus=min_focus,
+            workers=workers,
+            queue_size=queue_size,
+            max_distance=max_distance,
+            track=track,
+            focus_mode=focus_mode,
+            top_ratio=top_ratio,
+            debug=debug
+        )
+    ]
 
 
 if __name__ == '__main__':
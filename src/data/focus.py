@@ -0,0 +1,140 @@
+import numpy as np
+
+# Gating of the frames by their focus, see 'iter_cards_from_video':
+# - fixed: frames with a focus of at least 'min_focus'
+# - adaptive: frames among the 'top_ratio' sharpest frames seen so far
+# - two_pass: the 'top_ratio' sharpest frames of the whole video, measured
+#   by a first pass over the video
+FOCUS_MODES = ["fixed", "adaptive", "two_pass"]
+
+
+class StreamingQuantile():
+    """Streaming estimate of the quantile 'q' of a sequence of values, in
+    constant memory, with the P-square algorithm
+
+    Five markers track the minimum, the quantiles q/2, q, (1+q)/2 and the
+    maximum of the values seen so far. Every new value moves the markers
+    by at most one position, their heights being adjusted with a piecewise
+    parabolic interpolation.
+
+    Source: R. Jain and I. Chlamtac, The P2 algorithm for dynamic
+    calculation of quantiles and histograms without storing observations,
+    Communications of the ACM, 1985
+    """
+
+    def __init__(self, q: float):
+        """
+        Args:
+            q (float): quantile to estimate, in [0, 1]
+        """
+        if not 0 <= q <= 1:
+            raise ValueError(f"Quantile {q} not in [0, 1]")
+        self.q = q
+        self.count = 0
+        self._heights = []
+        # Actual and desired positions of the markers, and increments of
+        # the desired positions
+        self._positions = np.arange(1, 6, dtype=np.float64)
+        self._desired = np.array([1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5])
+        self._increments = np.array([0, q / 2, q, (1 + q) / 2, 1])
+
+    def add(self, x: float):
+        """Add the value 'x' to the sequence"""
+        self.count += 1
+        if self.count <= 5:
+            # The first values initialize the markers
+            self._heights.append(x)
+            self._heights.sort()
+            if self.count == 5:
+                self._heights = np.array(self._heights, dtype=np.float64)
+            return
+
+        h = self._heights
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = int(np.searchsorted(h, x, side="right")) - 1
+        self._positions[k + 1:] += 1
+        self._desired += self._increments
+        for i in range(1, 4):
+            self._adjust(i)
+
+    def _adjust(self, i: int):
+        """Move the marker 'i' towards its desired position if it is off
+        by one position or more
+        """
+        h, n = self._heights, self._positions
+        d = self._desired[i] - n[i]
+        if not ((d >= 1 and n[i + 1] - n[i] > 1)
+                or (d <= -1 and n[i - 1] - n[i] < -1)):
+            return
+        d = np.sign(d)
+        # Parabolic prediction, linear if it breaks the order of the markers
+        height = h[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+        )
+        if not h[i - 1] < height < h[i + 1]:
+            j = i + int(d)
+            height = h[i] + d * (h[j] - h[i]) / (n[j] - n[i])
+        h[i] = height
+        n[i] += d
+
+    def value(self):
+        """Current estimate of the quantile, None if no value was added"""
+        if self.count == 0:
+            return None
+        if self.count < 5:
+            return float(np.quantile(self._heights, self.q))
+        return float(self._heights[2])
+
+
+class FocusGate():
+    """Admit, on the fly, the frames among the 'top_ratio' sharpest frames
+    of a video: a frame is admitted if its focus reaches the running
+    estimate of the (1 - top_ratio) quantile of the focus of the frames
+    seen so far, see 'StreamingQuantile'
+
+    The threshold adapts to every video: in a dim video, the sharpest
+    frames are still processed, while in a sharp video, only the best
+    frames pay for the costly filtering and contour search.
+    """
+
+    def __init__(self, top_ratio: float = 0.2, warmup: int = 10):
+        """
+        Args:
+            top_ratio (float, optional): fraction of the frames admitted.
+                Defaults to 0.2.
+            warmup (int, optional): the first 'warmup' frames are all
+                admitted, while the estimate is still unreliable.
+                Defaults to 10.
+        """
+        self.quantile = StreamingQuantile(1 - top_ratio)
+        self.warmup = warmup
+        self.admitted = 0
+
+    def admit(self, focus: float):
+        """Add the focus of the next frame, return whether it is admitted"""
+        self.quantile.add(focus)
+        admitted = self.quantile.count <= self.warmup \
+            or focus >= self.quantile.value()
+        self.admitted += admitted
+        return admitted
+
+    @property
+    def threshold(self):
+        """Current focus threshold, None before the first frame"""
+        return self.quantile.value()
+
+
+def top_focus_threshold(focuses: list, top_ratio: float = 0.2):
+    """Focus threshold of the 'top_ratio' sharpest frames of 'focuses', the
+    exact counterpart of 'FocusGate' once the focus of every frame is known
+    """
+    if len(focuses) == 0:
+        return None
+    return float(np.quantile(focuses, 1 - top_ratio))
@@ -0,0 +1,159 @@
+import cv2
+import hashlib
+import numpy as np
+import os
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from src.data.card import ReferenceCard
+
+# Bump when the hull detection of 'ReferenceCard.hulls' changes, so that
+# hulls computed by a previous version are not reused
+HULL_VERSION = 1
+
+
+class HullCache():
+    """Cache of the corner hulls of card images ('ReferenceCard.hulls'),
+    keyed by the content hash of the encoded card image and the parameters
+    of the reference card
+
+    Hulls are persisted in a SQLite database, with an in-memory LRU in
+    front of it, so that the hulls of a card are computed once, however
+    many times the card is used.
+    """
+
+    def __init__(
+        self,
+        path: str = "data/interim/hull_cache.sqlite",
+        ref_card: ReferenceCard = ReferenceCard(),
+        maxsize: int = 4096,
+        commit_every: int = 256
+    ):
+        """
+        Args:
+            path (str, optional): path of the database, None for an
+                in-memory only cache.
+                Defaults to "data/interim/hull_cache.sqlite".
+            ref_card (ReferenceCard, optional): reference card geometry.
+                Defaults to ReferenceCard().
+            maxsize (int, optional): number of entries of the in-memory
+                LRU. Defaults to 4096.
+            commit_every (int, optional): new hulls are committed to the
+                database by groups of 'commit_every', and on 'close'.
+                Defaults to 256.
+        """
+        self.ref_card = ref_card
+        self.maxsize = maxsize
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self._uncommitted = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._salt = repr((HULL_VERSION, ref_card.params())).encode()
+        self._db = None
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS hulls "
+                "(key TEXT PRIMARY KEY, hulls BLOB)")
+            self._db.commit()
+
+    def key(self, data: bytes):
+        """Cache key of the encoded card image 'data'"""
+        return hashlib.sha1(self._salt + data).hexdigest()
+
+    def _lookup(self, key: str):
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return self._lru[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT hulls FROM hulls WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    hulls = pickle.loads(row[0])
+                    self._remember(key, hulls)
+                    return hulls
+        return None
+
+    def _remember(self, key: str, hulls: list):
+        # The same arrays are handed out on every hit
+        for hull in hulls:
+            if hull is not None:
+                hull.flags.writeable = False
+        self._lru[key] = hulls
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    def _store(self, key: str, hulls: list):
+        with self._lock:
+            self._remember(key, hulls)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO hulls VALUES (?, ?)",
+                    (key, pickle.dumps(hulls)))
+                self._uncommitted += 1
+                if self._uncommitted >= self.commit_every:
+                    self._db.commit()
+                    self._uncommitted = 0
+
+    def hulls(self, data: bytes, img=None):
+        """Return the hulls of the encoded card image 'data', computing
+        them only if they are not cached yet
+
+        Args:
+            data (bytes): content of the card image file
+            img (np.array, optional): decoded 'data', if already available.
+                Defaults to None.
+
+        Returns:
+            list: hulls of 'box_tl' and 'box_br' (None if not found)
+        """
+        key = self.key(data)
+        hulls = self._lookup(key)
+        if hulls is not None:
+            self.hits += 1
+            return hulls
+        self.misses += 1
+        if img is None:
+            img = _decode(data)
+        hulls = self.ref_card.hulls(img)
+        self._store(key, hulls)
+        return hulls
+
+    def load(self, path: str):
+        """Read the card image file 'path' and return it with its hulls
+
+        Returns:
+            tuple: BGRA image and hulls of 'box_tl' and 'box_br'
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        img = _decode(data)
+        return img, self.hulls(data, img)
+
+    def close(self):
+        """Commit the new hulls and close the database"""
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _decode(data: bytes):
+    """Decode the image file content 'data', keeping the alpha channel"""
+    return cv2.imdecode(
+        np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
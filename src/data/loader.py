@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+import click
+import cv2
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import numpy as np
+from glob import glob
+from multiprocessing.shared_memory import SharedMemory
+from src.data.card import ReferenceCard
+from src.data.shards import ShardReader
+from src.data.writer import IMAGE_FORMATS
+
+
+def build_index(input_dir: str = "data/processed/cards"):
+    """Index the extracted cards of 'input_dir', either sharded containers
+    (see 'ShardReader') or image files, one sub-directory per card
+
+    Returns:
+        tuple: sorted list of the card classes, source of the cards (a
+            'ShardReader' or the list of the image files) and np.array of
+            the class indices of the cards of the source
+    """
+    reader = ShardReader(input_dir)
+    if len(reader):
+        source = reader
+        names = [e["card"] for e in reader.index]
+    else:
+        source = sorted(
+            f for image_format in IMAGE_FORMATS
+            for f in glob(os.path.join(input_dir, "*", "*." + image_format))
+        )
+        names = [os.path.basename(os.path.dirname(f)) for f in source]
+    classes = sorted(set(names))
+    index = {name: i for i, name in enumerate(classes)}
+    return classes, source, np.array([index[n] for n in names], np.int64)
+
+
+def card_data(source, i: int):
+    """Stored bytes of the card 'i' of the source 'source' of
+    'build_index': the content of its image file, or its bytes in the
+    shards (see 'ShardReader.data')
+    """
+    if isinstance(source, ShardReader):
+        return source.data(i).tobytes()
+    with open(source[i], "rb") as f:
+        return f.read()
+
+
+def read_card(source, i: int, data: bytes = None):
+    """BGRA image of the card 'i' of the source 'source' of 'build_index',
+    None if it can not be read. 'data' is its content returned by
+    'card_data', if already read.
+    """
+    if isinstance(source, ShardReader):
+        img = source[i]
+    elif data is not None:
+        img = cv2.imdecode(
+            np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    else:
+        img = cv2.imread(source[i], cv2.IMREAD_UNCHANGED)
+    if img is not None and img.ndim == 3 and img.shape[2] == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+    return img
+
+
+def _fill(out: np.array, source, i: int):
+    """Read the card 'i' of 'source' into 'out' (height, width, 4), resized
+    if it has not the shape of 'out'
+    """
+    img = read_card(source, i)
+    if img is None or img.ndim != 3:
+        raise ValueError(f"Can not read the card {i}")
+    if img.shape != out.shape:
+        cv2.resize(img, out.shape[1::-1], dst=out,
+                   interpolation=cv2.INTER_AREA)
+    else:
+        out[:] = img
+
+
+def _worker(shm_name: str, shape: tuple, source, tasks, done):
+    """Decode the batches requested on 'tasks' into their slot of the
+    shared memory 'shm_name', and report them on 'done'
+    """
+    # The parallelism comes from the worker processes
+    cv2.setNumThreads(1)
+    shm = SharedMemory(name=shm_name)
+    batches = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, batch_nb, indices = task
+            try:
+                for i, index in enumerate(indices):
+                    _fill(batches[slot, i], source, index)
+            except Exception as e:
+                done.put((batch_nb, f"{type(e).__name__}: {e}"))
+            else:
+                done.put((batch_nb, None))
+    finally:
+        del batches
+        shm.close()
+
+
+class CardLoader():
+    """Iterate over batches of extracted cards, decoded by worker processes
+
+    The card index is built once, when the loader is created. Worker
+    processes decode the cards of the next 'prefetch' batches into a ring of
+    fixed-shape uint8 slots in shared memory, while the previous batches
+    are consumed: a batch is handed out as a view of its slot, without any
+    copy nor pickling of the images.
+
+    Batches are class-balanced by default: every card of a batch is drawn
+    from a uniformly drawn class, so that the card directories holding few
+    cards are seen as often as the others.
+
+    Usage:
+        with CardLoader("data/processed/cards") as loader:
+            for images, labels in loader:
+                ...
+
+    A batch is only valid until the next one is requested: copy it to keep
+    it longer.
+    """
+
+    def __init__(
+        self,
+        input_dir: str = "data/processed/cards",
+        batch_size: int = 64,
+        workers: int = 4,
+        prefetch: int = None,
+        nb_batches: int = None,
+        balanced: bool = True,
+        ref_card: ReferenceCard = ReferenceCard(),
+        seed: int = None
+    ):
+        """
+        Args:
+            input_dir (str, optional): directory of the extracted cards,
+                see 'build_index'. Defaults to "data/processed/cards".
+            batch_size (int, optional): number of cards of a batch.
+                Defaults to 64.
+            workers (int, optional): number of decoding processes.
+                Defaults to 4.
+            prefetch (int, optional): number of batches decoded in advance.
+                Defaults to None (2 per worker).
+            nb_batches (int, optional): number of batches of the iteration.
+                Defaults to None (endless).
+            balanced (bool, optional): draw the classes uniformly, instead
+                of the cards. Defaults to True.
+            ref_card (ReferenceCard, optional): reference card geometry,
+                giving the shape of the cards. Defaults to ReferenceCard().
+            seed (int, optional): seed of the random generator.
+                Defaults to None.
+        """
+        self.classes, self.source, self.labels = build_index(input_dir)
+        if len(self.source) == 0:
+            raise ValueError(f"No card found in {input_dir}")
+        self.batch_size = batch_size
+        self.nb_batches = nb_batches
+        self.balanced = balanced
+        self.card_shape = (ref_card.height, ref_card.width, 4)
+        self.rng = np.random.default_rng(seed)
+        # Cards sorted by class, to draw a card of a class by its offset
+        self._order = np.argsort(self.labels, kind="stable")
+        self._counts = np.bincount(self.labels, minlength=len(self.classes))
+        self._starts = np.cumsum(self._counts) - self._counts
+
+        self.prefetch = prefetch or 2 * workers
+        shape = (self.prefetch, batch_size, *self.card_shape)
+        self._shm = SharedMemory(create=True, size=int(np.prod(shape)))
+        self._batches = np.ndarray(shape, dtype=np.uint8, buffer=self._shm.buf)
+        # The workers get the source of the cards: a 'ShardReader' maps its
+        # shards on first access, i.e. in the workers only
+        context = multiprocessing.get_context()
+        self._tasks = context.Queue()
+        self._done = context.Queue()
+        self._workers = [
+            context.Process(
+                target=_worker,
+                args=(self._shm.name, shape, self.source, self._tasks,
+                      self._done),
+                daemon=True
+            )
+            for _ in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._batch_labels = {}
+        self._ready = {}
+        self._submitted = 0
+        self._next = 0
+        self.wait_time = 0
+        self._start = time.perf_counter()
+        for _ in range(self.prefetch):
+            self._submit()
+
+    def _sample(self):
+        """Indices of the cards of a batch"""
+        if not self.balanced:
+            return self.rng.integers(0, len(self.source), self.batch_size)
+        classes = self.rng.integers(0, len(self.classes), self.batch_size)
+        classes = classes[self._counts[classes] > 0]
+        while len(classes) < self.batch_size:
+            # Classes of the list without any card (none in practice)
+            extra = self.rng.integers(0, len(self.classes), self.batch_size)
+            classes = np.concatenate([classes, extra[self._counts[extra] > 0]])
+        classes = classes[:self.batch_size]
+        offsets = (
+            self.rng.random(self.batch_size) * self._counts[classes]
+        ).astype(np.int64)
+        return self._order[self._starts[classes] + offsets]
+
+    def _submit(self):
+        """Request the decoding of the next batch into its slot"""
+        if self.nb_batches is not None and self._submitted >= self.nb_batches:
+            return
+        indices = self._sample()
+        self._batch_labels[self._submitted] = self.labels[indices]
+        self._tasks.put(
+            (self._submitted % self.prefetch, self._submitted, indices))
+        self._submitted += 1
+
+    def _wait(self, batch_nb: int):
+        """Wait until the batch 'batch_nb' is decoded"""
+        while batch_nb not in self._ready:
+            try:
+                done_nb, error = self._done.get(timeout=1)
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self._workers):
+                    raise RuntimeError("A card loader worker died")
+                continue
+            self._ready[done_nb] = error
+        error = self._ready.pop(batch_nb)
+        if error is not None:
+            raise RuntimeError(f"Batch {batch_nb} : {error}")
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """Next batch: view of the stack of BGRA cards (batch_size, height,
+        width, 4) and class indices of the cards (see 'classes')
+        """
+        if self._next > 0:
+            # The slot of the previous batch is free again
+            self._submit()
+        if self.nb_batches is not None and self._next >= self.nb_batches:
+            raise StopIteration
+        start = time.perf_counter()
+        self._wait(self._next)
+        self.wait_time += time.perf_counter() - start
+        batch_nb = self._next
+        self._next += 1
+        return (
+            self._batches[batch_nb % self.prefetch],
+            self._batch_labels.pop(batch_nb)
+        )
+
+    def stats(self):
+        """Number of batches handed out, throughput in cards/s, and time
+        spent waiting for the workers (total in seconds, and ratio of the
+        elapsed time)
+        """
+        elapsed = time.perf_counter() - self._start
+        return {
+            "batches": self._next,
+            "cards_per_s": self._next * self.batch_size / elapsed,
+            "wait_s": self.wait_time,
+            "wait_ratio": self.wait_time / elapsed
+        }
+
+    def close(self):
+        """Stop the workers and release the shared memory"""
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+        self._batches = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # A batch is still referenced, the memory is unmapped once it
+            # is garbage collected
+            pass
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+@click.command()
+@click.argument(
+    'input_dir',
+    type=click.Path(exists=True),
+    default="data/processed/cards"
+)
+@click.option('--batch-size', default=64, type=click.IntRange(min=1),
+              help='Number of cards of a batch.')
+@click.option('--workers', '-w', default=4, type=click.IntRange(min=1),
+              help='Number of decoding processes.')
+@click.option('--nb-batches', default=200, type=click.IntRange(min=1),
+              help='Number of batches loaded.')
+@click.option('--step-time', default=0.0, type=click.FloatRange(min=0),
+              help='Simulated training time of a batch, in ms.')
+@click.option('--balanced/--no-balanced', default=True,
+              help='Draw the classes uniformly, instead of the cards.')
+def loader(
+    input_dir: str = "data/processed/cards",
+    batch_size: int = 64,
+    workers: int = 4,
+    nb_batches: int = 200,
+    step_time: float = 0.0,
+    balanced: bool = True
+):
+    """ Measure the throughput of the card loader over the extracted cards
+        of INPUT_DIR, and the time a training step would wait for it.
+    """
+    logger = logging.getLogger(__name__)
+    with CardLoader(
+        input_dir,
+        batch_size=batch_size,
+        workers=workers,
+        nb_batches=nb_batches,
+        balanced=balanced,
+        seed=0
+    ) as card_loader:
+        logger.info(f"{len(card_loader.source)} cards, "
+                    f"{len(card_loader.classes)} classes")
+        counts = np.zeros(len(card_loader.classes), np.int64)
+        for _, labels in card_loader:
+            counts += np.bincount(labels, minlength=len(counts))
+            time.sleep(step_time / 1000)
+        stats = card_loader.stats()
+    logger.info(f"{stats['cards_per_s']:.0f} cards/s, waited "
+                f"{stats['wait_s']:.2f}s ({100 * stats['wait_ratio']:.1f}%)")
+    logger.info(f"Cards per class : min {counts.min()}, max {counts.max()}")
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    loader()
@@ -1,13 +1,147 @@
 # -*- coding: utf-8 -*-
 import click
 import logging
+import logging.handlers
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dotenv import find_dotenv, load_dotenv
-from src.data.extract_card import extract_cards_from_video
+from src.data.extract_card import (
+    count_cards_from_video,
+    iter_cards_from_video
+)
+from src.data.card import ReferenceCard
+from src.data.focus import FOCUS_MODES
+from src.data.manifest import Manifest, staging_dir, swap_dir
+from src.data.metrics import Metrics
+from src.data.shards import ShardWriter, COMPRESSIONS
+from src.data.writer import CardWriter, IMAGE_FORMATS
 import os
 from pathlib import Path
 import shutil
 
 
+def _init_worker(log_queue):
+    """Route the log records of a worker process to the parent logger
+
+    Args:
+        log_queue (Queue): queue consumed by a QueueListener in the parent
+    """
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+
+
+def _extract_video(
+    card_name: str,
+    video_filename: str,
+    card_path: str,
+    extract_kwargs: dict = {},
+    writer_kwargs: dict = {},
+    shard_kwargs: dict = None
+):
+    """Extract the cards of one video into its own directory 'card_path'
+
+    Every video owns a distinct 'card_path', so that the directory
+    (re)creation done by 'iter_cards_from_video' never races with
+    another worker.
+
+    Args:
+        card_name (str): name of the card shown in the video, e.g. 'Ah'
+        video_filename (str): path of the video
+        card_path (str): output directory of the extracted cards
+        extract_kwargs (dict, optional): arguments of
+            'iter_cards_from_video'. Defaults to {}.
+        writer_kwargs (dict, optional): arguments of the 'CardWriter' saving
+            the cards. Defaults to {}.
+        shard_kwargs (dict, optional): if specified, the cards are saved in
+            a sharded container created with these 'ShardWriter' arguments,
+            instead of one file per card. Defaults to None.
+
+    Returns:
+        tuple: card name, number of extracted images and metrics of the
+            extraction
+    """
+    logger = logging.getLogger(__name__)
+    logger.info(f"Processing {video_filename}")
+    metrics = Metrics()
+    extract_kwargs = dict(extract_kwargs, metrics=metrics)
+    if shard_kwargs is not None:
+        # Left over by an interrupted run
+        if os.path.exists(card_path):
+            shutil.rmtree(card_path)
+        with ShardWriter(card_path, **shard_kwargs) as shards:
+            for frame_nb, focus, card_img in iter_cards_from_video(
+                    video_filename, **extract_kwargs):
+                shards.add(
+                    card_img,
+                    card=card_name,
+                    video=video_filename,
+                    frame=frame_nb,
+                    focus=focus
+                )
+        return card_name, shards.nb_cards, metrics
+
+    with CardWriter(**writer_kwargs) as writer:
+        nb_imgs = count_cards_from_video(
+            video_filename, card_path, writer=writer, **extract_kwargs)
+    return card_name, nb_imgs, metrics
+
+
+def _report_metrics(
+    metrics: Metrics,
+    metrics_file: str = None,
+    prometheus_file: str = None
+):
+    """Log a summary of 'metrics' and export them to the specified files"""
+    logger = logging.getLogger(__name__)
+    report = metrics.to_dict()
+    for stage, timer in report["stages"].items():
+        logger.info(f"{stage:>10} : {timer['seconds']:8.2f}s "
+                    f"({timer['mean_ms']:.2f}ms x {timer['calls']})")
+    logger.info(f"Counters : {report['counters']}")
+    if metrics_file is not None:
+        metrics.to_json(metrics_file)
+        logger.info(f"Metrics saved in {metrics_file}")
+    if prometheus_file is not None:
+        metrics.to_prometheus_file(prometheus_file)
+        logger.info(f"Prometheus metrics saved in {prometheus_file}")
+
+
+def _extract_videos_parallel(jobs: list, workers: int):
+    """Run '_extract_video' on 'jobs' using a pool of 'workers' processes
+
+    Log records emitted by the workers are streamed back to the loggers of
+    the parent process while the videos are being processed.
+
+    Args:
+        jobs (list): list of arguments of '_extract_video'
+        workers (int): number of worker processes
+
+    Yields:
+        tuple: result of '_extract_video', in completion order
+    """
+    manager = multiprocessing.Manager()
+    log_queue = manager.Queue()
+    listener = logging.handlers.QueueListener(
+        log_queue,
+        *logging.getLogger().handlers,
+        respect_handler_level=True
+    )
+    listener.start()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(log_queue,)
+        ) as executor:
+            futures = [executor.submit(_extract_video, *job) for job in jobs]
+            for future in as_completed(futures):
+                yield future.result()
+    finally:
+        listener.stop()
+        manager.shutdown()
+
+
 @click.command()
 @click.argument(
     'input_path',
@@ -34,15 +168,137 @@ import shutil
     default=','.join(['A', 'K', 'Q', 'J', '10', '9', '8', '7', '6']),
     type=click.STRING
 )
+@click.option(
+    '--workers',
+    '-w',
+    default=1,
+    type=click.IntRange(min=1),
+    help='Number of videos processed in parallel.'
+)
+@click.option(
+    '--image-format',
+    default="png",
+    type=click.Choice(list(IMAGE_FORMATS)),
+    help='Lossless format of the extracted cards.'
+)
+@click.option(
+    '--png-compression',
+    default=3,
+    type=click.IntRange(0, 9),
+    help='PNG compression level, 0 is the fastest.'
+)
+@click.option(
+    '--writer-threads',
+    default=2,
+    type=click.IntRange(min=1),
+    help='Number of threads writing the cards of a video.'
+)
+@click.option(
+    '--output-format',
+    default="files",
+    type=click.Choice(["files", "shards"]),
+    help='One image file per card, or sharded containers.'
+)
+@click.option(
+    '--shard-size',
+    default=1024,
+    type=click.IntRange(min=1),
+    help='Number of cards per shard.'
+)
+@click.option(
+    '--shard-compression',
+    default="none",
+    type=click.Choice(COMPRESSIONS),
+    help='Raw card arrays, or PNG encoded cards in the shards.'
+)
+@click.option(
+    '--keep-ratio',
+    default=5,
+    type=click.IntRange(min=1),
+    help='One frame every KEEP_RATIO frames is processed.'
+)
+@click.option(
+    '--min-focus',
+    default=120,
+    type=click.FLOAT,
+    help='Minimal focus of a processed frame, in the fixed focus mode.'
+)
+@click.option(
+    '--focus-mode',
+    default="fixed",
+    type=click.Choice(FOCUS_MODES),
+    help='Gate the frames with MIN_FOCUS (fixed), or keep the TOP_RATIO '
+    'sharpest frames of every video, estimated on the fly (adaptive) or '
+    'measured by a first pass over the video (two_pass).'
+)
+@click.option(
+    '--top-ratio',
+    default=0.2,
+    type=click.FloatRange(0, 1, min_open=True),
+    help='Fraction of the sharpest frames processed in the adaptive focus '
+    'modes.'
+)
+@click.option(
+    '--max-distance',
+    default=None,
+    type=click.IntRange(min=0),
+    help='Suppress near-duplicate cards, whose hashes differ by at most '
+    'MAX_DISTANCE bits (out of 64).'
+)
+@click.option(
+    '--track/--no-track',
+    default=False,
+    help='Track the card from one frame to the next instead of searching '
+    'every frame, the frames of a video are then processed on one thread.'
+)
+@click.option(
+    '--metrics',
+    'metrics_file',
+    default=None,
+    type=click.Path(),
+    help='JSON file where the per-stage timings, reject counters and '
+    'frames per second of every video are saved.'
+)
+@click.option(
+    '--prometheus',
+    'prometheus_file',
+    default=None,
+    type=click.Path(),
+    help='File where the metrics are saved in the Prometheus text format.'
+)
+@click.option(
+    '--incremental/--full',
+    default=False,
+    help='Only process the videos which changed since the last run.'
+)
 def make_dataset(
     input_path: str = "data/raw/video",
     output_path: str = "data/processed/cards",
     input_file_extension: str = "mp4",
     card_suits: str = 's,h,d,c',
-    card_values: str = 'A,K,Q,J,10,9,8,7,6'
+    card_values: str = 'A,K,Q,J,10,9,8,7,6',
+    workers: int = 1,
+    image_format: str = "png",
+    png_compression: int = 3,
+    writer_threads: int = 2,
+    output_format: str = "files",
+    shard_size: int = 1024,
+    shard_compression: str = "none",
+    keep_ratio: int = 5,
+    min_focus: float = 120,
+    focus_mode: str = "fixed",
+    top_ratio: float = 0.2,
+    max_distance: int = None,
+    track: bool = False,
+    metrics_file: str = None,
+    prometheus_file: str = None,
+    incremental: bool = False
 ):
     """ Runs data processing scripts to turn raw data from (../raw) into
         cleaned data ready to be analyzed (saved in ../processed).
+
+        The videos and parameters used are recorded in a manifest, so that
+        an incremental run only processes the videos which changed.
     """
     logger = logging.getLogger(__name__)
     logger.info('-----------------------------------------------------------')
@@ -54,9 +310,47 @@ def make_dataset(
 
     output_path = Path(output_path)
 
-    if output_path.exists():
+    # Left over by an interrupted run
+    staging_path = staging_dir(output_path)
+    if os.path.exists(staging_path):
+        shutil.rmtree(staging_path)
+
+    if output_path.exists() and not incremental:
         shutil.rmtree(output_path)
 
+    os.makedirs(output_path, exist_ok=True)
+    os.makedirs(staging_path)
+
+    extract_kwargs = {
+        "keep_ratio": keep_ratio,
+        "min_focus": min_focus,
+        "focus_mode": focus_mode,
+        "top_ratio": top_ratio,
+        "max_distance": max_distance,
+        "track": track
+    }
+    writer_kwargs = {
+        "image_format": image_format,
+        "png_compression": png_compression
+    }
+    shard_kwargs = {
+        "shard_size": shard_size,
+        "compression": shard_compression,
+        "png_compression": png_compression
+    } if output_format == "shards" else None
+    # Everything which has an influence on the extracted cards, but not the
+    # settings which only change the speed, e.g. the number of threads
+    params = {
+        "extract": extract_kwargs,
+        "ref_card": ReferenceCard().params(),
+        "output_format": output_format,
+        "writer": writer_kwargs if shard_kwargs is None else shard_kwargs
+    }
+    writer_kwargs = dict(writer_kwargs, workers=writer_threads)
+
+    manifest = Manifest(output_path)
+    video_states = {}
+    jobs = []
     for suit in card_suits:
         for value in card_values:
 
@@ -64,11 +358,52 @@ def make_dataset(
             video_filename = os.path.join(
                 input_path, card_name+"."+input_file_extension)
 
-            card_path = Path(os.path.join(output_path, card_name))
-            os.makedirs(card_path)
+            video_state = manifest.video_state(card_name, video_filename)
+            if video_state is None:
+                logger.warning(f"Video file {video_filename} does not exist")
+                continue
+            video_states[card_name] = video_state
+            if not manifest.is_stale(card_name, video_state, params):
+                # Up to date, only refresh the recorded modification time
+                manifest.update(card_name, video_state, params)
+                continue
+
+            # Cards are extracted aside, then swapped with the previous ones
+            card_path = os.path.join(staging_path, card_name)
+            jobs.append((
+                card_name,
+                video_filename,
+                card_path,
+                extract_kwargs,
+                writer_kwargs,
+                shard_kwargs
+            ))
+    manifest.save()
+    logger.info(f"{len(jobs)} videos to process, "
+                f"{len(video_states) - len(jobs)} up to date")
+
+    if workers > 1:
+        results = _extract_videos_parallel(jobs, workers)
+    else:
+        results = (_extract_video(*job) for job in jobs)
+
+    metrics = Metrics()
+    for i, (card_name, nb_imgs, video_metrics) in enumerate(
+            results, start=1):
+        metrics.merge(video_metrics)
+        swap_dir(
+            os.path.join(staging_path, card_name),
+            os.path.join(output_path, card_name)
+        )
+        manifest.update(card_name, video_states[card_name], params)
+        manifest.save()
+        fps = sum(v["fps"] for v in video_metrics.videos)
+        logger.info(
+            f"[{i}/{len(jobs)}] Extracted images for {card_name} : {nb_imgs}"
+            f" ({fps:.1f} frames/s)")
 
-            imgs = extract_cards_from_video(video_filename, card_path)
-            logger.info(f"Extracted images for {card_name} : {len(imgs)}")
+    shutil.rmtree(staging_path)
+    _report_metrics(metrics, metrics_file, prometheus_file)
 
 
 if __name__ == '__main__':
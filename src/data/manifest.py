@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import shutil
+
+MANIFEST_FILE = "manifest.json"
+# Suffix of the sibling directory of a dataset where new outputs are staged
+STAGING_SUFFIX = ".staging"
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20):
+    """SHA-256 of the content of the file 'path'"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _as_json(value):
+    """'value' as read back from JSON, e.g. with lists instead of tuples"""
+    return json.loads(json.dumps(value))
+
+
+def staging_dir(output_path: str):
+    """Directory where the outputs of the dataset 'output_path' are staged
+
+    It is a sibling of 'output_path', not a sub-directory: the readers of
+    the dataset take every sub-directory as a card, and must never see a
+    partial output left over by an interrupted run.
+    """
+    return os.path.normpath(str(output_path)) + STAGING_SUFFIX
+
+
+def swap_dir(new_dir: str, target_dir: str):
+    """Replace the directory 'target_dir' by 'new_dir'
+
+    'new_dir' is renamed to 'target_dir' (the previous 'target_dir' being
+    moved aside first, next to 'new_dir'), so that 'target_dir' never holds
+    a partial output: readers see either the previous or the new complete
+    directory.
+    """
+    old_dir = new_dir + ".old"
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    if os.path.exists(target_dir):
+        os.rename(target_dir, old_dir)
+    os.rename(new_dir, target_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
+
+class Manifest():
+    """Record of the input videos (hash, size, modification time) and of
+    the extraction parameters which produced every card directory of a
+    dataset, used to only reprocess the videos which changed
+    """
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.path = os.path.join(output_path, MANIFEST_FILE)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    def video_state(self, card_name: str, video_file: str):
+        """State (size, mtime, hash) of 'video_file'. The video is only
+        hashed if its size or modification time differ from the ones
+        recorded for 'card_name'.
+
+        Returns:
+            dict: state of the video, None if the video does not exist
+        """
+        if not os.path.isfile(video_file):
+            return None
+        stat = os.stat(video_file)
+        state = {"size": stat.st_size, "mtime": stat.st_mtime}
+        previous = self.entries.get(card_name, {}).get("video", {})
+        if previous.get("size") == state["size"] \
+                and previous.get("mtime") == state["mtime"]:
+            state["sha256"] = previous["sha256"]
+        else:
+            state["sha256"] = file_hash(video_file)
+        return state
+
+    def is_stale(self, card_name: str, video_state: dict, params: dict):
+        """Whether the cards of 'card_name' must be extracted again, in
+        particular if their directory was removed
+        """
+        entry = self.entries.get(card_name)
+        return entry is None \
+            or not os.path.isdir(os.path.join(self.output_path, card_name)) \
+            or entry["video"]["sha256"] != video_state["sha256"] \
+            or entry["params"] != _as_json(params)
+
+    def update(self, card_name: str, video_state: dict, params: dict):
+        self.entries[card_name] = {
+            "video": video_state,
+            "params": _as_json(params)
+        }
+
+    def save(self):
+        """Write the manifest atomically"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,110 @@
+import json
+import time
+from contextlib import contextmanager
+
+
+class Metrics():
+    """Instrumentation of the card extraction pipeline
+
+    Holds:
+        - per-stage timers: number of calls and total time of every stage
+          of 'extract_card' (focus, bilateral, canny, contours, ...)
+        - counters, e.g. the number of frames rejected for every reason
+        - per-video statistics: frames processed, cards extracted and
+          frames per second
+
+    A 'Metrics' is not thread-safe: concurrent frames are measured with
+    their own 'Metrics', merged afterwards with 'merge'. It only holds
+    plain data, so it can be returned by worker processes.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.videos = []
+
+    @contextmanager
+    def timed(self, stage: str):
+        """Add the time spent in the block to the timer of 'stage'"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage: str, seconds: float, calls: int = 1):
+        timer = self.stages.setdefault(stage, {"calls": 0, "seconds": 0.0})
+        timer["calls"] += calls
+        timer["seconds"] += seconds
+
+    def count(self, name: str, n: int = 1):
+        """Increment the counter 'name' by 'n'"""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_video(self, video: str, frames: int, cards: int, seconds: float):
+        """Record the statistics of a processed video"""
+        self.videos.append({
+            "video": video,
+            "frames": frames,
+            "cards": cards,
+            "seconds": seconds,
+            "fps": frames / seconds if seconds > 0 else 0.0
+        })
+
+    def merge(self, other: "Metrics"):
+        """Add the timers, counters and videos of 'other'"""
+        for stage, timer in other.stages.items():
+            self.add_time(stage, timer["seconds"], timer["calls"])
+        for name, n in other.counters.items():
+            self.count(name, n)
+        self.videos.extend(other.videos)
+
+    def to_dict(self):
+        """Report of the metrics, with the mean time of every stage"""
+        return {
+            "stages": {
+                stage: dict(
+                    timer,
+                    mean_ms=1000 * timer["seconds"] / max(timer["calls"], 1)
+                )
+                for stage, timer in sorted(self.stages.items())
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "videos": self.videos
+        }
+
+    def to_json(self, path: str):
+        """Write the report of 'to_dict' to the JSON file 'path'"""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def to_prometheus(self, prefix: str = "card_extraction"):
+        """Metrics in the Prometheus text exposition format"""
+        lines = [
+            f"# TYPE {prefix}_stage_seconds_total counter",
+            *(f'{prefix}_stage_seconds_total{{stage="{stage}"}} '
+              f'{timer["seconds"]}'
+              for stage, timer in sorted(self.stages.items())),
+            f"# TYPE {prefix}_stage_calls_total counter",
+            *(f'{prefix}_stage_calls_total{{stage="{stage}"}} '
+              f'{timer["calls"]}'
+              for stage, timer in sorted(self.stages.items())),
+            f"# TYPE {prefix}_events_total counter",
+            *(f'{prefix}_events_total{{event="{name}"}} {n}'
+              for name, n in sorted(self.counters.items())),
+            f"# TYPE {prefix}_video_frames_per_second gauge",
+            *(f'{prefix}_video_frames_per_second'
+              f'{{video="{_escape(v["video"])}"}} {v["fps"]}'
+              for v in self.videos)
+        ]
+        return "\n".join(lines) + "\n"
+
+    def to_prometheus_file(self, path: str, prefix: str = "card_extraction"):
+        """Write 'to_prometheus' to 'path', e.g. for a textfile collector"""
+        with open(path, "w") as f:
+            f.write(self.to_prometheus(prefix))
+
+
+def _escape(value: str):
+    """Escape a Prometheus label value"""
+    return value.replace("\\", "\\\\").replace('"', '\\"')
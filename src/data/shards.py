@@ -0,0 +1,216 @@
+import csv
+import cv2
+import json
+import os
+import numpy as np
+from fnmatch import fnmatch
+from glob import glob
+
+META_FILE = "meta.json"
+INDEX_FILE = "index.csv"
+INDEX_FIELDS = [
+    "shard", "offset", "length", "card", "video", "frame", "focus"
+]
+COMPRESSIONS = ["none", "png"]
+
+
+def _shard_file(shard: int):
+    return f"shard-{shard:05d}.bin"
+
+
+class ShardWriter():
+    """Write cards into a sharded container instead of one file per card
+
+    A container is a directory holding:
+        - shard-XXXXX.bin: fixed-size shards of 'shard_size' cards, either
+          the raw card arrays or their PNG encodings, concatenated
+        - index.csv: one row per card with its shard, its byte offset and
+          length in the shard, its card class, source video, frame number
+          and focus
+        - meta.json: compression and shape of the cards
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        shard_size: int = 1024,
+        compression: str = "none",
+        png_compression: int = 3
+    ):
+        """
+        Args:
+            output_dir (str): directory of the container
+            shard_size (int, optional): number of cards per shard.
+                Defaults to 1024.
+            compression (str, optional): "none" to store the raw arrays,
+                "png" to store PNG encodings. Defaults to "none".
+            png_compression (int, optional): PNG compression level.
+                Defaults to 3.
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unsupported compression {compression}")
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.compression = compression
+        self.png_params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        self.shape = None
+        self.nb_cards = 0
+        self._shard = None
+        self._offset = 0
+        self._index = open(
+            os.path.join(output_dir, INDEX_FILE), "w", newline="")
+        self._csv = csv.writer(self._index)
+        self._csv.writerow(INDEX_FIELDS)
+
+    def _encode(self, img: np.array):
+        if self.compression == "png":
+            ok, buf = cv2.imencode(".png", img, self.png_params)
+            if not ok:
+                raise ValueError("Could not encode card")
+            return buf.tobytes()
+        if self.shape is not None and img.shape != self.shape:
+            raise ValueError(
+                f"Card of shape {img.shape} in a container of {self.shape}")
+        return np.ascontiguousarray(img).tobytes()
+
+    def add(
+        self,
+        img: np.array,
+        card: str = "",
+        video: str = "",
+        frame: int = -1,
+        focus: float = float("nan")
+    ):
+        """Append the card 'img' to the container with its metadata"""
+        data = self._encode(img)
+        if self.shape is None:
+            self.shape = img.shape
+            self._write_meta()
+        shard = self.nb_cards // self.shard_size
+        if self.nb_cards % self.shard_size == 0:
+            if self._shard is not None:
+                self._shard.close()
+            self._shard = open(
+                os.path.join(self.output_dir, _shard_file(shard)), "wb")
+            self._offset = 0
+        self._shard.write(data)
+        self._csv.writerow(
+            [shard, self._offset, len(data), card, video, frame, focus])
+        self._offset += len(data)
+        self.nb_cards += 1
+
+    def _write_meta(self):
+        with open(os.path.join(self.output_dir, META_FILE), "w") as f:
+            json.dump({
+                "compression": self.compression,
+                "shape": list(self.shape),
+                "shard_size": self.shard_size
+            }, f)
+
+    def close(self):
+        if self._shard is not None:
+            self._shard.close()
+            self._shard = None
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _Container():
+    """Read access to the shards of one container"""
+
+    def __init__(self, path: str):
+        self.path = path
+        # No meta file for a container without any card
+        meta = {"compression": "none", "shape": []}
+        if os.path.exists(os.path.join(path, META_FILE)):
+            with open(os.path.join(path, META_FILE)) as f:
+                meta = json.load(f)
+        self.compression = meta["compression"]
+        self.shape = tuple(meta["shape"])
+        self._shards = {}
+
+    def shard(self, shard: int):
+        """Memory map of the shard 'shard', opened on first access"""
+        if shard not in self._shards:
+            self._shards[shard] = np.memmap(
+                os.path.join(self.path, _shard_file(shard)),
+                dtype=np.uint8, mode="r")
+        return self._shards[shard]
+
+    def data(self, shard: int, offset: int, length: int):
+        """Raw bytes (as a read-only uint8 view) of a card"""
+        return self.shard(shard)[offset:offset + length]
+
+    def decode(self, data: np.array):
+        if self.compression == "png":
+            return cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+        return data.reshape(self.shape)
+
+
+class ShardReader():
+    """Random access and sequential reads of the cards of one or several
+    sharded containers (see 'ShardWriter'): 'root' itself or its
+    sub-directories, e.g. the card directories of 'data/processed/cards'
+
+    Shards are memory-mapped: for uncompressed containers, cards are
+    returned as zero-copy read-only views.
+    """
+
+    def __init__(self, root: str = "data/processed/cards"):
+        paths = [
+            os.path.dirname(f)
+            for f in sorted(glob(os.path.join(root, INDEX_FILE))) +
+            sorted(glob(os.path.join(root, "*", INDEX_FILE)))
+        ]
+        self._containers = [_Container(path) for path in paths]
+        self.index = []
+        for c, path in enumerate(paths):
+            with open(os.path.join(path, INDEX_FILE), newline="") as f:
+                for row in csv.DictReader(f):
+                    self.index.append({
+                        "container": c,
+                        "shard": int(row["shard"]),
+                        "offset": int(row["offset"]),
+                        "length": int(row["length"]),
+                        "card": row["card"],
+                        "video": row["video"],
+                        "frame": int(row["frame"]),
+                        "focus": float(row["focus"])
+                    })
+
+    def __len__(self):
+        return len(self.index)
+
+    def data(self, i: int):
+        """Stored bytes of the card 'i' (encoded, or raw array bytes)"""
+        entry = self.index[i]
+        return self._containers[entry["container"]].data(
+            entry["shard"], entry["offset"], entry["length"])
+
+    def __getitem__(self, i: int):
+        """Card 'i' as a BGRA array"""
+        entry = self.index[i]
+        container = self._containers[entry["container"]]
+        return container.decode(self.data(i))
+
+    def __iter__(self):
+        """Stream the cards with their index entry, in storage order, i.e.
+        sequentially through every shard
+        """
+        for i, entry in enumerate(self.index):
+            yield entry, self[i]
+
+    def select(self, card_filter: str = "*"):
+        """Indices of the cards whose class matches 'card_filter' (a shell
+        pattern, e.g. "A*")
+        """
+        return [
+            i for i, entry in enumerate(self.index)
+            if fnmatch(entry["card"], card_filter)
+        ]
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+import click
+import cv2
+import logging
+import threading
+import time
+import numpy as np
+from collections import deque
+from src.data.card import ReferenceCard
+from src.data.extract_card import extract_cards
+from src.data.metrics import Metrics
+
+
+class DropOldestBuffer():
+    """Bounded buffer between a producer and consumers: when it is full,
+    'put' drops the oldest item instead of blocking, so that a slow
+    consumer always gets the most recent items
+    """
+
+    def __init__(self, maxsize: int = 1):
+        self._items = deque()
+        self._maxsize = maxsize
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self._maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout: float = None):
+        """Oldest item of the buffer, waiting for one if it is empty
+
+        Returns:
+            the item, None if the buffer is closed and empty or on timeout
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._items or self._closed, timeout=timeout)
+            return self._items.popleft() if self._items else None
+
+    def close(self):
+        """Wake up the consumers, 'get' returns None once empty"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class StreamingDetector():
+    """Long-running detection of the cards shown by a live source
+
+    A capture thread reads the frames of any 'cv2.VideoCapture' source
+    (camera index, RTSP URL, video file...) into a 'DropOldestBuffer':
+    when the detection falls behind, the oldest frames are dropped, so that
+    the latency stays bounded. Detection threads run 'extract_cards' on
+    the buffered frames and publish every detection, with its latency, to
+    the callback 'on_detection' or, by default, to the buffer
+    'detections', whose 'get' returns None once the stream is over.
+
+    A detection is a dict with the frame number, its capture timestamp
+    ('time.perf_counter'), the latency between capture and publication in
+    seconds, and the list of (card, corners) extracted from the frame.
+    """
+
+    def __init__(
+        self,
+        source,
+        on_detection=None,
+        ref_card: ReferenceCard = ReferenceCard(),
+        min_focus: float = 120,
+        max_cards: int = None,
+        realtime: bool = False,
+        buffer_size: int = 1,
+        workers: int = 1,
+        history: int = 1000
+    ):
+        """
+        Args:
+            source (int or str): source opened with 'cv2.VideoCapture'
+            on_detection (callable, optional): called with every detection,
+                from the detection threads. Defaults to None (detections
+                are put in 'detections').
+            ref_card (ReferenceCard, optional): reference card geometry.
+                Defaults to ReferenceCard().
+            min_focus (float, optional): minimal focus of a processed frame.
+                Defaults to 120.
+            max_cards (int, optional): maximal number of cards extracted
+                from a frame. Defaults to None (no limit).
+            realtime (bool, optional): read the source no faster than its
+                frame rate, to replay a video file as a live source.
+                Defaults to False.
+            buffer_size (int, optional): number of frames waiting for
+                detection. Defaults to 1 (only the latest frame).
+            workers (int, optional): number of detection threads.
+                Defaults to 1.
+            history (int, optional): number of latencies kept for the
+                statistics. Defaults to 1000.
+        """
+        self.source = source
+        self.on_detection = on_detection
+        self.ref_card = ref_card
+        self.min_focus = min_focus
+        self.max_cards = max_cards
+        self.realtime = realtime
+        self.workers = workers
+        self.detections = DropOldestBuffer(history)
+        self.metrics = Metrics()
+        self.nb_read = 0
+        self.nb_processed = 0
+        self._frames = DropOldestBuffer(buffer_size)
+        self._latencies = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._active = 0
+        self.fps = None
+
+    def start(self):
+        """Open the source and start the capture and detection threads"""
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            raise IOError(f"Can not open the video source {self.source}")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps > 0 else None
+        self._threads = [
+            threading.Thread(target=self._capture, args=(cap,), daemon=True)
+        ] + [
+            threading.Thread(target=self._detect, daemon=True)
+            for _ in range(self.workers)
+        ]
+        self._active = self.workers
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _capture(self, cap: cv2.VideoCapture):
+        """Read the frames of 'cap' until the source is exhausted or the
+        detector is stopped
+        """
+        interval = 1 / self.fps if self.realtime and self.fps else 0
+        start = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                if interval:
+                    # Wait for the time the frame would be shown
+                    delay = start + self.nb_read * interval - \
+                        time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                self._frames.put((self.nb_read, time.perf_counter(), frame))
+                self.nb_read += 1
+        finally:
+            cap.release()
+            self._frames.close()
+
+    def _detect(self):
+        """Run the detection on the buffered frames and publish the
+        results, until the capture is over
+        """
+        while True:
+            item = self._frames.get()
+            if item is None:
+                break
+            frame_nb, timestamp, frame = item
+            frame_metrics = Metrics()
+            cards = extract_cards(
+                frame,
+                ref_card=self.ref_card,
+                min_focus=self.min_focus,
+                max_cards=self.max_cards,
+                metrics=frame_metrics
+            )
+            latency = time.perf_counter() - timestamp
+            with self._lock:
+                self.metrics.merge(frame_metrics)
+                self._latencies.append(latency)
+                self.nb_processed += 1
+            self._publish({
+                "frame": frame_nb,
+                "timestamp": timestamp,
+                "latency": latency,
+                "cards": cards
+            })
+        with self._lock:
+            self._active -= 1
+            if self._active == 0:
+                # The stream is over once the last frame is processed
+                self.detections.close()
+
+    def _publish(self, detection: dict):
+        if self.on_detection is not None:
+            self.on_detection(detection)
+        else:
+            self.detections.put(detection)
+
+    def stats(self):
+        """Statistics of the stream: frames read, processed and dropped,
+        and percentiles of the latency in milliseconds
+        """
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+        stats = {
+            "read": self.nb_read,
+            "processed": self.nb_processed,
+            "dropped": self._frames.dropped,
+            "frame_interval_ms": 1000 / self.fps if self.fps else None
+        }
+        if len(latencies):
+            stats.update({
+                "latency_p50_ms": float(np.percentile(latencies, 50)),
+                "latency_p99_ms": float(np.percentile(latencies, 99)),
+                "latency_max_ms": float(latencies.max())
+            })
+        return stats
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def stop(self):
+        """Stop the capture and wait for the detection threads"""
+        self._stop.set()
+        self.join()
+
+    def join(self, timeout: float = None):
+        """Wait for the end of the stream"""
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+@click.command()
+@click.argument('source')
+@click.option(
+    '--realtime/--no-realtime',
+    default=False,
+    help='Replay a video file at its frame rate.'
+)
+@click.option(
+    '--min-focus',
+    default=120,
+    type=click.FLOAT,
+    help='Minimal focus of a processed frame.'
+)
+@click.option(
+    '--max-cards',
+    default=None,
+    type=click.IntRange(min=1),
+    help='Maximal number of cards extracted from a frame.'
+)
+@click.option(
+    '--workers',
+    '-w',
+    default=1,
+    type=click.IntRange(min=1),
+    help='Number of detection threads.'
+)
+@click.option(
+    '--report-every',
+    default=5.0,
+    type=click.FLOAT,
+    help='Interval between 2 logs of the stream statistics, in seconds.'
+)
+def stream(
+    source: str,
+    realtime: bool = False,
+    min_focus: float = 120,
+    max_cards: int = None,
+    workers: int = 1,
+    report_every: float = 5.0
+):
+    """ Detect the cards shown by the video source SOURCE (camera index,
+        URL or video file) until it is exhausted or interrupted.
+    """
+    logger = logging.getLogger(__name__)
+    detector = StreamingDetector(
+        int(source) if source.isdigit() else source,
+        min_focus=min_focus,
+        max_cards=max_cards,
+        realtime=realtime,
+        workers=workers
+    )
+    with detector:
+        try:
+            while detector.is_running():
+                time.sleep(report_every)
+                logger.info(f"Stream statistics : {detector.stats()}")
+        except KeyboardInterrupt:
+            logger.info("Interrupted")
+    logger.info(f"Stream statistics : {detector.stats()}")
+    logger.info(f"Counters : {detector.metrics.counters}")
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    stream()
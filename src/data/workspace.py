@@ -0,0 +1,208 @@
+import cv2
+import threading
+import numpy as np
+
+
+def _scaled_size(size: tuple, scale: float):
+    """(width, height) of an image of 'size' downscaled by 'scale', as
+    computed by 'cv2.resize' with fx = fy = 'scale'
+    """
+    return (
+        max(int(round(size[0] * scale)), 1),
+        max(int(round(size[1] * scale)), 1)
+    )
+
+
+class FrameWorkspace():
+    """Images of a frame shared by the stages of the card extraction, in
+    buffers reused from one frame to the next
+
+    The frame is converted to gray once, and a pyramid of gray images
+    downscaled by 2 at every level is built from it: the coarse card
+    location, the edge detection and the debug views all read the level
+    they need instead of converting or resizing the BGR frame on their
+    own. The focus measure reads the BGR frame, or a downscaled copy of
+    it, as the original measure did. Every image is computed on first
+    access only, into a buffer which is allocated for the first frame and
+    reused as long as the frame size does not change.
+
+    A workspace holds the images of one frame at a time: it must not be
+    shared between threads, see 'thread_workspace'.
+
+    Usage:
+        workspace = FrameWorkspace()
+        for img in frames:
+            workspace.load(img)
+            focus = workspace.focus(0.25)
+    """
+
+    def __init__(self, levels: int = 3):
+        """
+        Args:
+            levels (int, optional): number of levels of the pyramid, the
+                full resolution gray image included. Defaults to 3 (full,
+                half and quarter resolution).
+        """
+        self.levels = levels
+        self.img = None
+        self._shape = None
+        self._buffers = {}
+        self._valid = set()
+        self._focus = {}
+
+    def load(self, img: np.array):
+        """Make the BGR image 'img' the current frame. The images of the
+        previous frame are invalidated, their buffers are kept.
+
+        Returns:
+            FrameWorkspace: the workspace itself
+        """
+        if img.shape[:2] != self._shape:
+            self._shape = img.shape[:2]
+            self._buffers = {}
+        self.img = img
+        self._valid = set()
+        self._focus = {}
+        return self
+
+    def _buffer(self, name, shape: tuple, dtype=np.uint8):
+        """Buffer 'name' of 'shape', allocated on first use"""
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self._buffers[name] = np.empty(shape, dtype=dtype)
+        return buf
+
+    def _scratch(self, name, shape: tuple, dtype=np.uint8):
+        """Contiguous buffer of 'shape', taken from the flat buffer 'name'
+        of the size of the frame, for the images of a zone of the frame
+        """
+        size = int(np.prod(shape))
+        flat = self._buffer(name, (self._shape[0] * self._shape[1],), dtype)
+        if size > len(flat):
+            flat = self._buffers[name] = np.empty(size, dtype=dtype)
+        return flat[:size].reshape(shape)
+
+    def size(self, level: int = 0):
+        """(width, height) of the pyramid level 'level'"""
+        return _scaled_size(self._shape[::-1], 0.5 ** level)
+
+    def gray(self, level: int = 0):
+        """Gray image of the frame, downscaled by 2 ** 'level'"""
+        if level >= self.levels:
+            raise ValueError(
+                f"Level {level} of a pyramid of {self.levels} levels")
+        key = ("gray", level)
+        if key in self._valid:
+            return self._buffers[key]
+        width, height = self.size(level)
+        buf = self._buffer(key, (height, width))
+        if level == 0:
+            cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY, dst=buf)
+        else:
+            # Halving with INTER_AREA averages 2x2 blocks: the levels are
+            # the same as the ones obtained by resizing the full image
+            cv2.resize(self.gray(level - 1), (width, height), dst=buf,
+                       interpolation=cv2.INTER_AREA)
+        self._valid.add(key)
+        return buf
+
+    def bgr(self, scale: float = None):
+        """Frame downscaled by 'scale' with INTER_AREA, the frame itself if
+        'scale' is not specified
+        """
+        if scale is None or scale == 1:
+            return self.img
+        key = ("bgr", scale)
+        if key not in self._valid:
+            width, height = _scaled_size(self._shape[::-1], scale)
+            cv2.resize(self.img, (width, height),
+                       dst=self._buffer(key, (height, width) +
+                                        self.img.shape[2:]),
+                       interpolation=cv2.INTER_AREA)
+            self._valid.add(key)
+        return self._buffers[key]
+
+    def scaled(self, scale: float = None):
+        """Gray image of the frame downscaled by 'scale', a level of the
+        pyramid if 'scale' is a power of 1/2, otherwise resized from the
+        full resolution level
+        """
+        if scale is None or scale == 1:
+            return self.gray(0)
+        level = -np.log2(scale)
+        if level == int(level) and level < self.levels:
+            return self.gray(int(level))
+        key = ("scaled", scale)
+        if key not in self._valid:
+            width, height = _scaled_size(self._shape[::-1], scale)
+            cv2.resize(self.gray(0), (width, height),
+                       dst=self._buffer(key, (height, width)),
+                       interpolation=cv2.INTER_AREA)
+            self._valid.add(key)
+        return self._buffers[key]
+
+    def focus(self, scale: float = None):
+        """Variance of the Laplacian of the frame downscaled by 'scale',
+        over all its channels, see 'bgr'
+
+        Source: A.Rosebrock,
+        https://www.pyimagesearch.com/2015/09/07/blur-detection-with-opencv/
+        """
+        if scale not in self._focus:
+            img = self.bgr(scale)
+            laplacian = self._buffer(("laplacian", scale), img.shape,
+                                     np.float64)
+            cv2.Laplacian(img, cv2.CV_64F, dst=laplacian)
+            # Variance over all the channels, from the per channel ones
+            mean, std = cv2.meanStdDev(laplacian)
+            self._focus[scale] = float(np.mean(std ** 2) + np.var(mean))
+        return self._focus[scale]
+
+    def filtered(self, roi: tuple):
+        """Bilateral filtered gray image of the zone 'roi' (x1, y1, x2, y2)
+        of the full resolution level, valid until the next call
+        """
+        x1, y1, x2, y2 = roi
+        gray = self.gray(0)[y1:y2, x1:x2]
+        # Noise-reducing and edge-preserving filter
+        filtered = self._scratch("filtered", gray.shape)
+        cv2.bilateralFilter(gray, 11, 17, 17, dst=filtered)
+        return filtered
+
+    def edges(self, gray: np.array):
+        """Canny edges of the gray image 'gray', e.g. returned by
+        'filtered', valid until the next call
+        """
+        edge = self._scratch("edge", gray.shape)
+        cv2.Canny(gray, 30, 200, edges=edge)
+        return edge
+
+    def coarse_edges(self, scale: float):
+        """Canny edges of the gray image downscaled by 'scale', smoothed
+        by a Gaussian blur
+        """
+        small = self.scaled(scale)
+        # A Gaussian blur is good enough at low resolution and much cheaper
+        # than the bilateral filter
+        blurred = self._buffer(("blurred", scale), small.shape)
+        cv2.GaussianBlur(small, (5, 5), 0, dst=blurred)
+        edge = self._buffer(("coarse_edge", scale), small.shape)
+        cv2.Canny(blurred, 30, 200, edges=edge)
+        return edge
+
+
+_local = threading.local()
+
+
+def thread_workspace(img: np.array = None):
+    """Workspace of the calling thread, loaded with 'img' if specified
+
+    Every thread gets its own workspace, reused for all the frames it
+    processes, e.g. by the worker threads of 'iter_cards_from_video'.
+    """
+    workspace = getattr(_local, "workspace", None)
+    if workspace is None:
+        workspace = _local.workspace = FrameWorkspace()
+    if img is not None:
+        workspace.load(img)
+    return workspace
@@ -0,0 +1,143 @@
+import cv2
+import logging
+import queue
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# Lossless formats supporting an alpha channel, with their encoding params
+IMAGE_FORMATS = {
+    "png": lambda level: [cv2.IMWRITE_PNG_COMPRESSION, level],
+    # Uncompressed TIFF and BMP: larger files but almost no encoding cost
+    "tiff": lambda level: [cv2.IMWRITE_TIFF_COMPRESSION, 1],
+    "bmp": lambda level: [],
+}
+
+
+class CardWriter():
+    """Write images to disk on a pool of background threads
+
+    Images are handed over through a bounded queue, so that encoding and
+    writing overlap with the extraction instead of blocking it, while the
+    memory used by images waiting to be written stays bounded.
+
+    Usage:
+        with CardWriter() as writer:
+            writer.write(os.path.join(output_dir, "card" + writer.extension),
+                         img)
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        queue_size: int = 64,
+        image_format: str = "png",
+        png_compression: int = 3,
+        block: bool = True
+    ):
+        """
+        Args:
+            workers (int, optional): number of writing threads.
+                Defaults to 2.
+            queue_size (int, optional): maximum number of images waiting to
+                be written. Defaults to 64.
+            image_format (str, optional): one of 'IMAGE_FORMATS'.
+                Defaults to "png".
+            png_compression (int, optional): PNG compression level, from 0
+                (fastest, largest files) to 9. Defaults to 3 (OpenCV
+                default).
+            block (bool, optional): if True, 'write' waits for room in the
+                queue, otherwise the image is dropped when the queue is
+                full. Defaults to True.
+        """
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format {image_format}")
+        self.extension = "." + image_format
+        self.params = IMAGE_FORMATS[image_format](png_compression)
+        self.block = block
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = [
+            threading.Thread(target=self._run, daemon=True)
+            for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                path, img = item
+                try:
+                    ok = cv2.imwrite(path, img, self.params)
+                except cv2.error:
+                    ok = False
+                with self._lock:
+                    if ok:
+                        self.written += 1
+                    else:
+                        self.failed += 1
+                if not ok:
+                    logger.warning(f"Failed to write {path}")
+            finally:
+                self._queue.task_done()
+
+    def write(self, path: str, img):
+        """Queue 'img' to be written to 'path'. 'img' must not be modified
+        afterwards.
+
+        Returns:
+            bool: False if the image has been dropped
+        """
+        try:
+            self._queue.put((path, img), block=self.block)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def flush(self):
+        """Wait until all queued images are written"""
+        self._queue.join()
+
+    def stats(self):
+        """Return the number of written, failed and dropped images"""
+        with self._lock:
+            return {
+                "written": self.written,
+                "failed": self.failed,
+                "dropped": self.dropped
+            }
+
+    def close(self):
+        """Write the queued images, stop the threads and report the number
+        of written, failed and dropped images
+
+        Returns:
+            dict: see 'stats'
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        stats = self.stats()
+        if stats["failed"] or stats["dropped"]:
+            logger.warning(
+                f"{stats['failed']} images failed to be written, "
+                f"{stats['dropped']} dropped")
+        return stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,354 @@
+import click
+import cv2
+import json
+import logging
+import numpy as np
+import os
+from shapely.geometry import Polygon, box
+from shapely.ops import unary_union
+from src.data.background import Backgrounds
+from src.data.card import ReferenceCard
+from src.data.hull_cache import HullCache
+from src.data.loader import build_index, card_data, read_card
+from src.data.writer import CardWriter
+
+
+def load_cards(
+    input_dir: str = "data/processed/cards",
+    ref_card: ReferenceCard = ReferenceCard(),
+    max_per_class: int = None,
+    hull_cache: HullCache = None
+):
+    """Load the extracted cards of 'input_dir' (image files of any format
+    or sharded containers, see 'build_index') together with the hulls of
+    their 2 corners. Cards without any hull are skipped.
+
+    Args:
+        input_dir (str, optional): directory of the extracted cards.
+            Defaults to "data/processed/cards".
+        ref_card (ReferenceCard, optional): reference card geometry.
+            Defaults to ReferenceCard().
+        max_per_class (int, optional): maximum number of cards loaded per
+            card class. Defaults to None (all).
+        hull_cache (HullCache, optional): if specified, hulls are taken
+            from (and added to) this cache instead of being computed with
+            'ref_card'. Defaults to None.
+
+    Returns:
+        list: tuples (BGRA image, card name, list of the 2 hulls)
+    """
+    classes, source, labels = build_index(input_dir)
+    counts = np.zeros(len(classes), dtype=np.int64)
+    cards = []
+    for i, label in enumerate(labels):
+        if max_per_class is not None and counts[label] >= max_per_class:
+            continue
+        counts[label] += 1
+        img, hulls = _load_card(source, i, ref_card, hull_cache)
+        if img is None or all(hull is None for hull in hulls):
+            continue
+        cards.append((img, classes[label], hulls))
+    return cards
+
+
+def _load_card(
+    source,
+    i: int,
+    ref_card: ReferenceCard,
+    hull_cache: HullCache
+):
+    """Read the card 'i' of 'source' (see 'build_index') and its hulls,
+    (None, None) if it is not a BGR or BGRA image
+    """
+    data = card_data(source, i) if hull_cache is not None else None
+    img = read_card(source, i, data)
+    if img is None or img.ndim != 3:
+        return None, None
+    if hull_cache is not None:
+        return img, hull_cache.hulls(data, img)
+    return img, ref_card.hulls(img)
+
+
+class SceneGenerator():
+    """Generate training scenes: cards randomly rotated, scaled and placed
+    on random backgrounds, labelled with the convex hulls (and their
+    bounding boxes) of the card corners
+
+    Scenes are generated by batches in a (batch, height, width, 3) BGR
+    uint8 stack. The random transformations of a batch are drawn at once,
+    every card is warped only over its bounding box and alpha blended with
+    integer arithmetic, and the labels are obtained by applying the same
+    affine transformations to the hulls of the cards.
+    """
+
+    def __init__(
+        self,
+        backgrounds: Backgrounds,
+        cards: list,
+        scene_size: tuple = (720, 720),
+        max_cards: int = 3,
+        scale_range: tuple = (0.5, 1.0),
+        max_rotation: float = 180,
+        min_visibility: float = 0.7,
+        brightness: float = 30,
+        contrast: float = 0.2,
+        augmenter=None,
+        seed: int = None
+    ):
+        """
+        Args:
+            backgrounds (Backgrounds): backgrounds of the scenes
+            cards (list): tuples (BGRA image, card name, hulls), see
+                'load_cards'
+            scene_size (tuple, optional): (width, height) of the scenes.
+                Defaults to (720, 720).
+            max_cards (int, optional): a scene has between 1 and
+                'max_cards' cards. Defaults to 3.
+            scale_range (tuple, optional): range of the card scaling.
+                Defaults to (0.5, 1.0).
+            max_rotation (float, optional): cards are rotated by a random
+                angle in [-max_rotation, max_rotation] degrees.
+                Defaults to 180.
+            min_visibility (float, optional): a hull covered by another
+                card is labelled only if this fraction of its area is still
+                visible. Defaults to 0.7.
+            brightness (float, optional): maximum brightness shift of a
+                scene. Defaults to 30.
+            contrast (float, optional): maximum relative contrast change of
+                a scene. Defaults to 0.2.
+            augmenter (callable, optional): additional augmentation applied
+                to the stack of scenes, e.g. the 'augment_images' method of
+                an imgaug augmenter. It must not move pixels, as labels are
+                not updated. Defaults to None.
+            seed (int, optional): seed of the random generator.
+                Defaults to None.
+        """
+        self.backgrounds = backgrounds
+        self.cards = cards
+        self.scene_size = scene_size
+        self.max_cards = max_cards
+        self.scale_range = scale_range
+        self.max_rotation = max_rotation
+        self.min_visibility = min_visibility
+        self.brightness = brightness
+        self.contrast = contrast
+        self.augmenter = augmenter
+        self.rng = np.random.default_rng(seed)
+
+    def _transforms(self, nb: int, card_sizes: np.array):
+        """Draw 'nb' random affine transformations (nb, 2, 3), rotating and
+        scaling a card of size 'card_sizes' (nb, 2) around its center and
+        moving its center to a random point of the scene
+        """
+        width, height = self.scene_size
+        theta = np.deg2rad(
+            self.rng.uniform(-self.max_rotation, self.max_rotation, nb))
+        scale = self.rng.uniform(*self.scale_range, nb)
+        tx = self.rng.uniform(0.1 * width, 0.9 * width, nb)
+        ty = self.rng.uniform(0.1 * height, 0.9 * height, nb)
+        cos, sin = scale * np.cos(theta), scale * np.sin(theta)
+        cw, ch = card_sizes[:, 0] / 2, card_sizes[:, 1] / 2
+        return np.stack([
+            np.stack([cos, -sin, tx - cos * cw + sin * ch], axis=1),
+            np.stack([sin, cos, ty - sin * cw - cos * ch], axis=1),
+        ], axis=1)
+
+    def _background(self, out: np.array):
+        """Fill 'out' (height, width, 3) with a random background"""
+        bg = self.backgrounds.get_random()
+        if bg.ndim == 2:
+            bg = cv2.cvtColor(bg, cv2.COLOR_GRAY2RGB)
+        # Backgrounds are RGB, scenes are BGR like the cards
+        out[:] = cv2.resize(bg, self.scene_size)[:, :, ::-1]
+
+    @staticmethod
+    def _blend(scene: np.array, card: np.array, M: np.array, corners):
+        """Warp the BGRA 'card' with 'M' and alpha blend it into 'scene',
+        only over the bounding box 'corners' of the warped card
+        """
+        height, width = scene.shape[:2]
+        x0, y0 = np.maximum(np.floor(corners.min(axis=0)), 0).astype(int)
+        x1 = min(int(np.ceil(corners[:, 0].max())) + 1, width)
+        y1 = min(int(np.ceil(corners[:, 1].max())) + 1, height)
+        if x1 <= x0 or y1 <= y0:
+            return
+        M = M.copy()
+        M[:, 2] -= (x0, y0)
+        warped = cv2.warpAffine(
+            card, M, (x1 - x0, y1 - y0),
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=0
+        )
+        roi = scene[y0:y1, x0:x1]
+        alpha = warped[:, :, 3:].astype(np.uint16)
+        roi[:] = (
+            warped[:, :, :3] * alpha + roi * (255 - alpha) + 127
+        ) // 255
+
+    def _labels(self, names: list, hulls: list, Ms: np.array, corners):
+        """Transform the hulls of the cards of a scene with the card
+        transformations 'Ms', and drop the hulls covered by the cards put
+        on top of them or out of the scene
+
+        Returns:
+            list: dicts with the card name, the hull and its bounding box
+        """
+        width, height = self.scene_size
+        scene_box = box(0, 0, width, height)
+        outlines = [Polygon(c) for c in corners]
+        labels = []
+        for i, (name, card_hulls, M) in enumerate(zip(names, hulls, Ms)):
+            above = unary_union(outlines[i+1:]) if i + 1 < len(names) \
+                else None
+            for hull in card_hulls:
+                if hull is None:
+                    continue
+                pts = hull.reshape(-1, 2) @ M[:, :2].T + M[:, 2]
+                poly = Polygon(pts)
+                visible = poly.intersection(scene_box)
+                if above is not None:
+                    visible = visible.difference(above)
+                if poly.area == 0 \
+                        or visible.area < self.min_visibility * poly.area:
+                    continue
+                labels.append({
+                    "card": name,
+                    "hull": pts,
+                    "bbox": [*pts.min(axis=0), *pts.max(axis=0)]
+                })
+        return labels
+
+    def _augment(self, scenes: np.array):
+        """Random brightness and contrast change of every scene of the
+        stack, in place
+        """
+        nb = len(scenes)
+        alpha = self.rng.uniform(1 - self.contrast, 1 + self.contrast, nb)
+        beta = self.rng.uniform(-self.brightness, self.brightness, nb)
+        for scene, a, b in zip(scenes, alpha, beta):
+            cv2.convertScaleAbs(scene, dst=scene, alpha=a, beta=b)
+        if self.augmenter is not None:
+            scenes[:] = self.augmenter(scenes)
+
+    def generate(self, batch_size: int = 32):
+        """Generate a batch of scenes
+
+        Args:
+            batch_size (int, optional): number of scenes. Defaults to 32.
+
+        Returns:
+            tuple: stack of BGR scenes (batch_size, height, width, 3) and
+                list of the labels of every scene
+        """
+        width, height = self.scene_size
+        scenes = np.empty((batch_size, height, width, 3), dtype=np.uint8)
+
+        # Draw all the random choices of the batch at once
+        nb_cards = self.rng.integers(1, self.max_cards + 1, batch_size)
+        card_ids = self.rng.integers(0, len(self.cards), nb_cards.sum())
+        card_sizes = np.array(
+            [self.cards[i][0].shape[1::-1] for i in card_ids],
+            dtype=np.float64)
+        Ms = self._transforms(len(card_ids), card_sizes)
+        outlines = np.stack([
+            np.zeros_like(card_sizes),
+            card_sizes * (1, 0),
+            card_sizes,
+            card_sizes * (0, 1)
+        ], axis=1)
+        corners = np.einsum("nij,nkj->nki", Ms[:, :, :2], outlines) \
+            + Ms[:, None, :, 2]
+
+        labels = []
+        first = 0
+        for scene, nb in zip(scenes, nb_cards):
+            self._background(scene)
+            ids = card_ids[first:first + nb]
+            for j, i in enumerate(ids):
+                self._blend(
+                    scene, self.cards[i][0], Ms[first + j], corners[first + j])
+            labels.append(self._labels(
+                [self.cards[i][1] for i in ids],
+                [self.cards[i][2] for i in ids],
+                Ms[first:first + nb],
+                corners[first:first + nb]
+            ))
+            first += nb
+
+        self._augment(scenes)
+        return scenes, labels
+
+
+@click.command()
+@click.argument(
+    'input_dir',
+    type=click.Path(exists=True),
+    default="data/processed/cards"
+)
+@click.argument(
+    'output_dir',
+    type=click.Path(),
+    default="data/processed/scenes"
+)
+@click.option('--backgrounds', default="data/raw/backgrounds",
+              type=click.Path(exists=True),
+              help='Directory of the background store.')
+@click.option('--nb-scenes', default=1000, type=click.IntRange(min=1),
+              help='Number of scenes to generate.')
+@click.option('--batch-size', default=64, type=click.IntRange(min=1),
+              help='Number of scenes generated at once.')
+@click.option('--max-per-class', default=None, type=click.INT,
+              help='Maximum number of cards loaded per card class.')
+@click.option('--hull-cache', default="data/interim/hull_cache.sqlite",
+              type=click.Path(),
+              help='Database caching the hulls of the cards.')
+def build_features(
+    input_dir: str = "data/processed/cards",
+    output_dir: str = "data/processed/scenes",
+    backgrounds: str = "data/raw/backgrounds",
+    nb_scenes: int = 1000,
+    batch_size: int = 64,
+    max_per_class: int = None,
+    hull_cache: str = "data/interim/hull_cache.sqlite"
+):
+    """ Generates training scenes from the extracted cards (saved in
+        ../processed/scenes), with their labels in labels.jsonl
+    """
+    logger = logging.getLogger(__name__)
+    with HullCache(hull_cache) as cache:
+        cards = load_cards(
+            input_dir, max_per_class=max_per_class, hull_cache=cache)
+        logger.info(
+            f"Hulls : {cache.hits} from cache, {cache.misses} computed")
+    logger.info(f"Nb of cards loaded : {len(cards)}")
+    generator = SceneGenerator(Backgrounds(backgrounds), cards)
+
+    os.makedirs(output_dir, exist_ok=True)
+    with CardWriter() as writer, \
+            open(os.path.join(output_dir, "labels.jsonl"), "w") as f:
+        for first in range(0, nb_scenes, batch_size):
+            scenes, labels = generator.generate(
+                min(batch_size, nb_scenes - first))
+            for i, (scene, scene_labels) in enumerate(zip(scenes, labels)):
+                filename = f"scene_{first + i:07d}" + writer.extension
+                writer.write(os.path.join(output_dir, filename), scene)
+                f.write(json.dumps({
+                    "file": filename,
+                    "labels": [
+                        {
+                            "card": label["card"],
+                            "hull": label["hull"].tolist(),
+                            "bbox": [float(v) for v in label["bbox"]]
+                        }
+                        for label in scene_labels
+                    ]
+                }) + "\n")
+            logger.info(f"Generated {first + len(scenes)} scenes")
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    build_features()
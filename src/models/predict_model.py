@@ -0,0 +1,648 @@
+# -*- coding: utf-8 -*-
+import click
+import cv2
+import http.client
+import io
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.data.card import ReferenceCard
+from src.data.loader import build_index, read_card
+
+# Size (width, height) of the normalized content of a corner
+DESCRIPTOR_SIZE = (16, 32)
+
+
+def corner_descriptors(
+    img: np.array,
+    hulls: list = None,
+    ref_card: ReferenceCard = ReferenceCard(),
+    size: tuple = DESCRIPTOR_SIZE
+):
+    """Descriptors of the 2 corners of the card 'img'
+
+    The content of the hull of a corner (value and suit symbols) is cropped
+    and resized to 'size', the whole corner zone being used if no hull is
+    found. The bottom right corner is rotated by 180 degrees, so that both
+    corners of a card give the same descriptor. A descriptor is made of 2
+    channels: the gray levels, and the redness which tells the red suits
+    from the black ones. Every channel is centered and normalized, so that
+    the dot product of 2 descriptors is the mean correlation of their
+    channels.
+
+    Args:
+        img (np.array): BGR or BGRA card, as extracted by 'extract_card'
+        hulls (list, optional): hulls of the 2 corners, computed with
+            'ref_card.hulls' if not specified. Defaults to None.
+        ref_card (ReferenceCard, optional): reference card geometry.
+            Defaults to ReferenceCard().
+        size (tuple, optional): (width, height) of the normalized corner
+            content. Defaults to DESCRIPTOR_SIZE.
+
+    Returns:
+        np.array: float32 array of shape (2, 2 * width * height)
+    """
+    if hulls is None:
+        hulls = ref_card.hulls(img)
+    channels = np.empty((2, 2, size[1], size[0]), dtype=np.float32)
+    for i, ((x1, y1, x2, y2), hull) in enumerate(
+            zip(ref_card.corner_zones(), hulls)):
+        if hull is not None:
+            x, y, w, h = cv2.boundingRect(hull)
+            x1, y1, x2, y2 = x, y, x + w, y + h
+        # Only the content of the corner is resized, then converted
+        content = cv2.resize(
+            img[y1:y2, x1:x2, :3], size, interpolation=cv2.INTER_AREA)
+        if i == 1:
+            content = cv2.rotate(content, cv2.ROTATE_180)
+        channels[i, 0] = cv2.cvtColor(content, cv2.COLOR_BGR2GRAY)
+        channels[i, 1] = cv2.subtract(
+            content[:, :, 2], np.maximum(content[:, :, 0], content[:, :, 1]))
+    channels = _normalize(channels.reshape(2, 2, -1)) / np.sqrt(2)
+    return channels.reshape(2, -1)
+
+
+def _normalize(descriptors: np.array):
+    """Center the descriptors (last axis) and scale them to unit norm"""
+    descriptors = descriptors - descriptors.mean(axis=-1, keepdims=True)
+    norm = np.linalg.norm(descriptors, axis=-1, keepdims=True)
+    return descriptors / np.maximum(norm, 1e-6)
+
+
+class CornerClassifier():
+    """Identify the card shown by an extracted card image from its corners
+
+    Every class (e.g. "Ah") has a template: the mean of the normalized
+    corner descriptors of its training cards, see 'train_model'. The
+    descriptors of a batch of cards are stacked and compared to all the
+    templates at once with a single matrix product; the score of a class is
+    the mean correlation of the 2 corners of the card with its template.
+    """
+
+    def __init__(
+        self,
+        templates: np.array,
+        classes: list,
+        ref_card: ReferenceCard = ReferenceCard(),
+        size: tuple = DESCRIPTOR_SIZE
+    ):
+        """
+        Args:
+            templates (np.array): array (nb classes, descriptor length),
+                e.g. the sums of the descriptors of every class
+            classes (list): names of the classes
+            ref_card (ReferenceCard, optional): reference card geometry.
+                Defaults to ReferenceCard().
+            size (tuple, optional): see 'corner_descriptors'.
+                Defaults to DESCRIPTOR_SIZE.
+        """
+        self.templates = _normalize(np.asarray(templates, dtype=np.float32))
+        self.classes = np.array(classes)
+        self.ref_card = ref_card
+        self.size = tuple(size)
+
+    @staticmethod
+    def load(
+        path: str = "models/corner_templates.npz",
+        ref_card: ReferenceCard = ReferenceCard()
+    ):
+        """Load the templates saved by 'save'"""
+        data = np.load(path)
+        if tuple(data["ref_card"]) != ref_card.params():
+            raise ValueError(
+                f"Templates of {path} were built for another reference card")
+        return CornerClassifier(
+            data["templates"], list(data["classes"]), ref_card,
+            tuple(data["size"]))
+
+    def save(self, path: str = "models/corner_templates.npz"):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(
+            path,
+            templates=self.templates,
+            classes=self.classes,
+            size=np.array(self.size),
+            ref_card=np.array(self.ref_card.params())
+        )
+
+    def descriptors(self, cards: list, hulls: list = None):
+        """Stacked corner descriptors of 'cards', array of shape
+        (nb cards, 2, descriptor length)
+        """
+        if hulls is None:
+            hulls = [None] * len(cards)
+        return np.stack([
+            corner_descriptors(img, h, self.ref_card, self.size)
+            for img, h in zip(cards, hulls)
+        ])
+
+    def scores(self, descriptors: np.array):
+        """Scores (nb cards, nb classes) of stacked descriptors"""
+        return (descriptors @ self.templates.T).mean(axis=1)
+
+    def predict(self, cards: list, hulls: list = None):
+        """Classify a batch of cards
+
+        Args:
+            cards (list): BGR or BGRA cards, as extracted by 'extract_card'
+            hulls (list, optional): hulls of the corners of every card,
+                e.g. from a 'HullCache'. Defaults to None (computed).
+
+        Returns:
+            tuple: array of the predicted classes and array of their scores
+                (correlation, between -1 and 1)
+        """
+        if len(cards) == 0:
+            return self.classes[:0], np.zeros(0, dtype=np.float32)
+        scores = self.scores(self.descriptors(cards, hulls))
+        best = scores.argmax(axis=1)
+        return self.classes[best], scores[np.arange(len(best)), best]
+
+
+class MicroBatcher():
+    """Gather the items submitted by concurrent callers into micro-batches,
+    processed by a single call of 'func' on a dedicated thread
+
+    A batch is processed as soon as it holds 'max_batch' items, or
+    'max_wait' seconds after its first item was submitted, whichever
+    comes first.
+    If the call fails, the items of the batch are processed one by one,
+    so that only the futures of the failing items get the exception.
+    """
+
+    def __init__(
+        self,
+        func,
+        max_batch: int = 64,
+        max_wait: float = 0.005,
+        history: int = 10000
+    ):
+        """
+        Args:
+            func (callable): called with a list of items, returns the list
+                of their results
+            max_batch (int, optional): maximal number of items of a batch.
+                Defaults to 64.
+            max_wait (float, optional): maximal time an item waits for the
+                batch to fill, in seconds. Defaults to 0.005.
+            history (int, optional): number of latencies kept for the
+                statistics. Defaults to 10000.
+        """
+        self.func = func
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.nb_batches = 0
+        self.nb_items = 0
+        self._queue = queue.Queue()
+        self._latencies = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Submit 'item', return a 'Future' of its result"""
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def _next_batch(self):
+        """Wait for an item, then gather a batch around it"""
+        batch = [self._queue.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=timeout) \
+                    if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Stop after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            items, futures, submitted = zip(*batch)
+            try:
+                results = self.func(list(items))
+            except Exception:
+                # Only the failing items must get the exception
+                self._run_one_by_one(items, futures)
+                continue
+            done = time.perf_counter()
+            with self._lock:
+                self.nb_batches += 1
+                self.nb_items += len(items)
+                self._latencies.extend(done - t for t in submitted)
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def _run_one_by_one(self, items: tuple, futures: tuple):
+        """Process the items of a failed batch separately"""
+        for item, future in zip(items, futures):
+            try:
+                future.set_result(self.func([item])[0])
+            except Exception as e:
+                future.set_exception(e)
+
+    def stats(self):
+        """Queue depth, batches and latency percentiles in milliseconds"""
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            stats = {
+                "queue_depth": self._queue.qsize(),
+                "batches": self.nb_batches,
+                "items": self.nb_items,
+                "mean_batch_size":
+                    self.nb_items / self.nb_batches if self.nb_batches else 0
+            }
+        if len(latencies):
+            stats["latency_p50_ms"] = float(np.percentile(latencies, 50))
+            stats["latency_p99_ms"] = float(np.percentile(latencies, 99))
+        return stats
+
+    def close(self):
+        """Process the items already submitted, then stop"""
+        self._queue.put(None)
+        self._thread.join()
+
+
+def _check_cards(cards: np.array, ref_card: ReferenceCard):
+    """Error message if 'cards' is not a batch of BGR or BGRA uint8 cards of
+    the size of 'ref_card', None otherwise
+    """
+    shape = (ref_card.height, ref_card.width)
+    if cards.dtype != np.uint8:
+        return f"Cards must be uint8, not {cards.dtype}"
+    # The batch axis is required: a single gray card and a batch of gray
+    # cards would both be 3D
+    if cards.ndim != 4 or cards.shape[3] not in (3, 4):
+        return "Cards must be an array (N, height, width, 3 or 4), " \
+            f"not {cards.shape}"
+    if cards.shape[1:3] != shape:
+        return f"Cards must be {shape[1]}x{shape[0]}, " \
+            f"not {cards.shape[2]}x{cards.shape[1]}"
+    return None
+
+
+def _encode_cards(cards):
+    """Body of a prediction request: the cards as a .npy array"""
+    buf = io.BytesIO()
+    np.save(buf, np.stack(cards), allow_pickle=False)
+    return buf.getvalue()
+
+
+class _PredictionHandler(BaseHTTPRequestHandler):
+    """POST /predict: cards as a .npy array (N, height, width, channels),
+    returns the classes and scores as JSON, or the error with the status
+    400 for invalid cards, 411 without Content-Length and 500 if the
+    classification fails. GET /stats:
+    statistics of the micro-batching.
+    """
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are sent separately: without TCP_NODELAY,
+    # the body would wait for the delayed ACK of the client
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        if self.path != "/predict":
+            return self._reply(404, {"error": "unknown path"})
+        length = self.headers["Content-Length"]
+        if length is None:
+            # The end of the body is unknown: the connection can not be
+            # reused
+            self.close_connection = True
+            return self._reply(411, {"error": "Content-Length required"})
+        try:
+            length = int(length)
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            self.close_connection = True
+            return self._reply(
+                400, {"error": f"Invalid Content-Length {length}"})
+        cards = self._load_cards(self.rfile.read(length))
+        if not isinstance(cards, np.ndarray):
+            return self._reply(400, {"error": cards})
+        error = _check_cards(cards, self.server.ref_card)
+        if error is not None:
+            return self._reply(400, {"error": error})
+        futures = [self.server.batcher.submit(card) for card in cards]
+        try:
+            results = [future.result() for future in futures]
+        except Exception as e:
+            logging.getLogger(__name__).exception("Classification failed")
+            return self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+        self._reply(200, {
+            "classes": [str(c) for c, _ in results],
+            "scores": [float(s) for _, s in results]
+        })
+
+    @staticmethod
+    def _load_cards(body: bytes):
+        """Array of the .npy 'body', or the error message if it is not a
+        .npy array
+        """
+        try:
+            cards = np.load(io.BytesIO(body), allow_pickle=False)
+        except (ValueError, EOFError, OSError) as e:
+            return str(e)
+        if not isinstance(cards, np.ndarray):
+            # e.g. a .npz archive
+            cards.close()
+            return "Cards must be a .npy array"
+        return cards
+
+    def do_GET(self):
+        if self.path != "/stats":
+            return self._reply(404, {"error": "unknown path"})
+        self._reply(200, self.server.batcher.stats())
+
+    def _reply(self, status: int, content: dict):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+
+class _UnixPredictionHandler(_PredictionHandler):
+    # TCP options are not supported by Unix sockets
+    disable_nagle_algorithm = False
+
+
+class _UnixHTTPServer(
+    socketserver.ThreadingMixIn,
+    socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("local", 0)
+
+
+class PredictionServer():
+    """Local server sharing one 'CornerClassifier' between several
+    processes, on localhost HTTP or on a Unix socket
+
+    The cards of all the requests are gathered into micro-batches by a
+    'MicroBatcher', and classified by a single call of
+    'CornerClassifier.predict' per batch.
+    """
+
+    def __init__(
+        self,
+        classifier: CornerClassifier,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        socket_path: str = None,
+        max_batch: int = 64,
+        max_wait: float = 0.005
+    ):
+        """
+        Args:
+            classifier (CornerClassifier): the classifier
+            host (str, optional): address of the HTTP server.
+                Defaults to "127.0.0.1".
+            port (int, optional): port of the HTTP server, 0 for any free
+                port. Defaults to 8765.
+            socket_path (str, optional): if specified, the server listens
+                on this Unix socket instead. Defaults to None.
+            max_batch (int, optional): see 'MicroBatcher'. Defaults to 64.
+            max_wait (float, optional): see 'MicroBatcher'.
+                Defaults to 0.005.
+        """
+        self.batcher = MicroBatcher(
+            lambda cards: list(zip(*classifier.predict(cards))),
+            max_batch=max_batch,
+            max_wait=max_wait
+        )
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.httpd = _UnixHTTPServer(
+                socket_path, _UnixPredictionHandler)
+        else:
+            self.httpd = ThreadingHTTPServer((host, port), _PredictionHandler)
+            self.httpd.daemon_threads = True
+        self.httpd.batcher = self.batcher
+        self.httpd.ref_card = classifier.ref_card
+        self.address = socket_path or self.httpd.server_address[:2]
+        self._thread = None
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        """Serve on a background thread"""
+        self._thread = threading.Thread(
+            target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.batcher.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path: str, timeout: float = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class PredictionClient():
+    """Client of a 'PredictionServer', keeping its connection open"""
+
+    def __init__(self, address=("127.0.0.1", 8765), timeout: float = 10):
+        """
+        Args:
+            address (tuple or str, optional): (host, port) of the HTTP
+                server, or path of its Unix socket.
+                Defaults to ("127.0.0.1", 8765).
+            timeout (float, optional): timeout of a request, in seconds.
+                Defaults to 10.
+        """
+        if isinstance(address, str):
+            self._conn = _UnixHTTPConnection(address, timeout=timeout)
+        else:
+            self._conn = http.client.HTTPConnection(
+                *address, timeout=timeout)
+
+    def _request(self, method: str, path: str, body: bytes = None):
+        self._conn.request(method, path, body=body)
+        response = self._conn.getresponse()
+        content = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(f"Server error : {content['error']}")
+        return content
+
+    def predict(self, cards: list):
+        """Classify 'cards', see 'CornerClassifier.predict'
+
+        Returns:
+            tuple: list of the predicted classes and list of their scores
+        """
+        if len(cards) == 0:
+            return [], []
+        content = self._request("POST", "/predict", _encode_cards(cards))
+        return content["classes"], content["scores"]
+
+    def stats(self):
+        """Statistics of the server, see 'MicroBatcher.stats'"""
+        return self._request("GET", "/stats")
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("evaluate")
+@click.argument(
+    'input_dir',
+    type=click.Path(exists=True),
+    default="data/processed/cards"
+)
+@click.argument(
+    'model_file',
+    type=click.Path(exists=True),
+    default="models/corner_templates.npz"
+)
+@click.option(
+    '--batch-size',
+    default=256,
+    type=click.IntRange(min=1),
+    help='Number of cards classified at once.'
+)
+def predict_model(input_dir: str, model_file: str, batch_size: int = 256):
+    """ Classify the extracted cards of INPUT_DIR (image files or sharded
+        containers, one class per card directory) and report the accuracy
+        and the throughput.
+    """
+    logger = logging.getLogger(__name__)
+    classifier = CornerClassifier.load(model_file)
+    classes, source, labels = build_index(input_dir)
+    logger.info(f"{len(source)} cards to classify")
+
+    # Cards are decoded batch by batch, only the classification is timed
+    elapsed = 0
+    nb_cards = nb_correct = 0
+    for first in range(0, len(source), batch_size):
+        batch = range(first, min(first + batch_size, len(source)))
+        cards = [(read_card(source, i), labels[i]) for i in batch]
+        cards = [(img, label) for img, label in cards if img is not None]
+        start = time.perf_counter()
+        predictions, _ = classifier.predict([img for img, _ in cards])
+        elapsed += time.perf_counter() - start
+        nb_cards += len(cards)
+        nb_correct += sum(
+            p == classes[label] for p, (_, label) in zip(predictions, cards))
+
+    accuracy = nb_correct / nb_cards if nb_cards else 0
+    logger.info(f"Accuracy : {accuracy:.4f}")
+    logger.info(f"Throughput : {nb_cards / max(elapsed, 1e-9):.0f} "
+                "cards/s")
+
+
+@cli.command("serve")
+@click.argument(
+    'model_file',
+    type=click.Path(exists=True),
+    default="models/corner_templates.npz"
+)
+@click.option('--host', default="127.0.0.1", help='Address of the server.')
+@click.option('--port', default=8765, type=click.INT,
+              help='Port of the server.')
+@click.option('--socket', 'socket_path', default=None, type=click.Path(),
+              help='Listen on this Unix socket instead of HTTP.')
+@click.option('--max-batch', default=64, type=click.IntRange(min=1),
+              help='Maximal number of cards classified at once.')
+@click.option('--max-wait', default=5.0, type=click.FloatRange(min=0),
+              help='Maximal time a card waits for its batch to fill, in ms.')
+@click.option('--report-every', default=60.0, type=click.FLOAT,
+              help='Interval between 2 logs of the statistics, in seconds.')
+def serve(
+    model_file: str,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    socket_path: str = None,
+    max_batch: int = 64,
+    max_wait: float = 5.0,
+    report_every: float = 60.0
+):
+    """ Serve the classifier of MODEL_FILE to the local processes,
+        classifying the received cards by micro-batches.
+    """
+    logger = logging.getLogger(__name__)
+    server = PredictionServer(
+        CornerClassifier.load(model_file),
+        host=host,
+        port=port,
+        socket_path=socket_path,
+        max_batch=max_batch,
+        max_wait=max_wait / 1000
+    )
+    logger.info(f"Serving on {server.address}")
+    with server:
+        try:
+            while True:
+                time.sleep(report_every)
+                logger.info(f"Statistics : {server.batcher.stats()}")
+        except KeyboardInterrupt:
+            logger.info("Interrupted")
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    cli()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+import numpy as np
+from src.data.card import ReferenceCard
+from src.data.hull_cache import HullCache
+from src.features.build_features import load_cards
+from src.models.predict_model import (
+    CornerClassifier,
+    DESCRIPTOR_SIZE,
+    corner_descriptors
+)
+
+
+def train(
+    cards: list,
+    ref_card: ReferenceCard = ReferenceCard(),
+    size: tuple = DESCRIPTOR_SIZE
+):
+    """Build the templates of a 'CornerClassifier': the template of a class
+    is the mean of the corner descriptors of its cards
+
+    Args:
+        cards (list): tuples (BGRA image, card name, hulls), as returned by
+            'load_cards'
+        ref_card (ReferenceCard, optional): reference card geometry.
+            Defaults to ReferenceCard().
+        size (tuple, optional): see 'corner_descriptors'.
+            Defaults to DESCRIPTOR_SIZE.
+
+    Returns:
+        CornerClassifier: classifier of the card names of 'cards'
+    """
+    classes = sorted(set(name for _, name, _ in cards))
+    index = {name: i for i, name in enumerate(classes)}
+    sums = np.zeros((len(classes), 2 * size[0] * size[1]), dtype=np.float64)
+    for img, name, hulls in cards:
+        # Both corners of a card are samples of its class
+        sums[index[name]] += corner_descriptors(
+            img, hulls, ref_card, size).sum(axis=0)
+    return CornerClassifier(sums, classes, ref_card, size)
+
+
+def _split(cards: list, validation: float, seed: int = 0):
+    """Random split of 'cards' into training and validation cards"""
+    rng = np.random.default_rng(seed)
+    is_validation = rng.random(len(cards)) < validation
+    return (
+        [c for c, v in zip(cards, is_validation) if not v],
+        [c for c, v in zip(cards, is_validation) if v]
+    )
+
+
+@click.command()
+@click.argument(
+    'input_dir',
+    type=click.Path(exists=True),
+    default="data/processed/cards"
+)
+@click.argument(
+    'model_file',
+    type=click.Path(),
+    default="models/corner_templates.npz"
+)
+@click.option('--max-per-class', default=None, type=click.INT,
+              help='Maximum number of cards loaded per card class.')
+@click.option('--hull-cache', default="data/interim/hull_cache.sqlite",
+              type=click.Path(),
+              help='Database caching the hulls of the cards.')
+@click.option('--validation', default=0.2, type=click.FloatRange(0, 1),
+              help='Fraction of the cards kept aside to measure the '
+              'accuracy.')
+def train_model(
+    input_dir: str = "data/processed/cards",
+    model_file: str = "models/corner_templates.npz",
+    max_per_class: int = None,
+    hull_cache: str = "data/interim/hull_cache.sqlite",
+    validation: float = 0.2
+):
+    """ Build the corner templates of the card classifier from the
+        extracted cards (image files or sharded containers, one class per
+        card directory) and save them.
+    """
+    logger = logging.getLogger(__name__)
+    with HullCache(hull_cache) as cache:
+        cards = load_cards(
+            input_dir, max_per_class=max_per_class, hull_cache=cache)
+    logger.info(f"Nb of cards loaded : {len(cards)}")
+
+    train_cards, validation_cards = _split(cards, validation)
+    classifier = train(train_cards)
+    logger.info(f"{len(classifier.classes)} classes, "
+                f"{len(train_cards)} training cards")
+
+    if validation_cards:
+        predictions, _ = classifier.predict(
+            [img for img, _, _ in validation_cards],
+            [hulls for _, _, hulls in validation_cards]
+        )
+        names = np.array([name for _, name, _ in validation_cards])
+        accuracy = np.mean(predictions == names)
+        logger.info(f"Validation accuracy : {accuracy:.4f} "
+                    f"({len(validation_cards)} cards)")
+
+    classifier.save(model_file)
+    logger.info(f"Templates saved in {model_file}")
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    train_model()
@@ -5,6 +5,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 from src.data.card import ReferenceCard
+from src.data.hull_cache import HullCache
+from src.data.shards import ShardReader
 from pathlib import Path
 from uuid import uuid4
 
@@ -54,26 +56,47 @@ def display_random_card(
     ref_card: ReferenceCard = ReferenceCard(),
     card_filter: str = "*",
     input_dir: str = "data/processed/cards",
-    fig_path: Path = f"data/test/random_card_{uuid4()}.png"
+    fig_path: Path = f"data/test/random_card_{uuid4()}.png",
+    hull_cache: HullCache = None,
+    reader: ShardReader = None
 ):
+    """Save to 'fig_path' a figure of a random extracted card with its
+    corner boxes and hulls. Cards are read from 'reader' if specified
+    (sharded containers), otherwise from the image files of 'input_dir'.
+    """
 
-    image_files = glob(input_dir + f"/{card_filter}/*.png")
-    selected_file = random.choice(image_files)
-    card_suit_value = selected_file.split("/")[-2]
-    img = cv2.imread(selected_file, cv2.IMREAD_UNCHANGED)
+    if reader is not None:
+        selected = random.choice(reader.select(card_filter))
+        card_suit_value = reader.index[selected]["card"]
+        img = reader[selected]
+        data = reader.data(selected).tobytes()
+    else:
+        image_files = glob(input_dir + f"/{card_filter}/*.png")
+        selected_file = random.choice(image_files)
+        card_suit_value = selected_file.split("/")[-2]
+        with open(selected_file, "rb") as f:
+            data = f.read()
+        img = cv2.imdecode(
+            np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
 
-    convex_hull = (
-        ref_card.cards[card_suit_value].ref_hull(img)
-        if card_suit_value[0] in ["1", "6", "7", "8", "9", "A"] else None
+    # Hulls are taken from 'hull_cache' when specified
+    if hull_cache is not None:
+        hulls = hull_cache.hulls(data, img)
+    else:
+        hulls = ref_card.hulls(img)
+
+    convex_hulls = (
+        [hull for hull in hulls if hull is not None]
+        if card_suit_value[0] in ["1", "6", "7", "8", "9", "A"] else []
     )
 
-    if convex_hull is not None:
+    if convex_hulls:
         fig, ax = display_image(
             img,
             polygons=[
                 ref_card.box_tl(),
                 ref_card.box_br(),
-                convex_hull
+                *convex_hulls
             ]
         )
     else:
@@ -94,8 +117,10 @@ if __name__ == '__main__':
         for value in ["6", "7", "8", "9", "10", "J", "Q", "K", "A"]
         for suit in ["h", "s", "d", "c"]
     ]
-    for card in cards:
-        display_random_card(
-            card_filter=card,
-            fig_path=f"data/test/random_card_{card}.png"
-        )
+    with HullCache() as hull_cache:
+        for card in cards:
+            display_random_card(
+                card_filter=card,
+                fig_path=f"data/test/random_card_{card}.png",
+                hull_cache=hull_cache
+            )
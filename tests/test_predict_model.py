@@ -0,0 +1,111 @@
+import http.client
+import io
+import numpy as np
+import pytest
+from src.data.card import ReferenceCard
+from src.models.predict_model import (
+    CornerClassifier,
+    MicroBatcher,
+    PredictionClient,
+    PredictionServer
+)
+
+
+@pytest.fixture(scope="module")
+def cards():
+    rng = np.random.default_rng(0)
+    ref_card = ReferenceCard()
+    shape = (ref_card.height, ref_card.width, 3)
+    return [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(3)]
+
+
+@pytest.fixture(scope="module")
+def classifier(cards):
+    descriptors = CornerClassifier(np.zeros((1, 1)), ["x"]).descriptors(cards)
+    return CornerClassifier(descriptors.mean(axis=1), ["Ah", "Kh", "Qs"])
+
+
+@pytest.fixture(params=["tcp", "unix"])
+def server(request, classifier, tmp_path):
+    if request.param == "unix":
+        server = PredictionServer(
+            classifier, socket_path=str(tmp_path / "predict.sock"))
+    else:
+        server = PredictionServer(classifier, port=0)
+    with server:
+        yield server
+
+
+@pytest.fixture
+def tcp_server(classifier):
+    with PredictionServer(classifier, port=0) as server:
+        yield server
+
+
+def _post(server, body: bytes, length: str = None):
+    """Status of a POST /predict of 'body' with the header Content-Length
+    'length', or without it if None
+    """
+    conn = http.client.HTTPConnection(*server.address, timeout=10)
+    try:
+        conn.putrequest("POST", "/predict")
+        if length is not None:
+            conn.putheader("Content-Length", length)
+        conn.endheaders(body)
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+def test_client_predicts_as_the_classifier(server, classifier, cards):
+    expected, expected_scores = classifier.predict(cards)
+    with PredictionClient(server.address) as client:
+        classes, scores = client.predict(cards)
+        assert client.predict([]) == ([], [])
+        assert client.stats()["items"] == len(cards)
+    assert classes == list(expected)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+
+def test_client_reports_invalid_cards(server, cards):
+    with PredictionClient(server.address) as client:
+        with pytest.raises(RuntimeError, match="uint8"):
+            client.predict([card.astype(np.float32) for card in cards])
+        with pytest.raises(RuntimeError, match="must be"):
+            client.predict([card[:10] for card in cards])
+        # The connection is still usable
+        assert len(client.predict(cards)[0]) == len(cards)
+
+
+@pytest.mark.parametrize("body, length, status", [
+    (b"junk", "4", 400),
+    (b"", None, 411),
+    (b"", "junk", 400),
+    (b"", "-1", 400),
+])
+def test_invalid_requests_get_a_reply(tcp_server, body, length, status):
+    assert _post(tcp_server, body, length) == status
+
+
+def test_npz_body_gets_a_reply(tcp_server, cards):
+    buf = io.BytesIO()
+    np.savez(buf, cards=np.stack(cards))
+    body = buf.getvalue()
+    assert _post(tcp_server, body, str(len(body))) == 400
+
+
+def test_batcher_isolates_failing_items():
+    def func(items):
+        if any(item < 0 for item in items):
+            raise ValueError("negative item")
+        return [2 * item for item in items]
+
+    batcher = MicroBatcher(func, max_wait=0.05)
+    try:
+        futures = [batcher.submit(item) for item in (1, -1, 3)]
+        assert futures[0].result(timeout=5) == 2
+        with pytest.raises(ValueError):
+            futures[1].result(timeout=5)
+        assert futures[2].result(timeout=5) == 6
+    finally:
+        batcher.close()